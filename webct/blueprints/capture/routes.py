@@ -1,9 +1,11 @@
+from typing import Optional
 from flask import jsonify, request, session
 from flask.wrappers import Response
 from webct.blueprints.capture import bp
 from webct.components.Capture import CaptureParameters
 from webct.components.imgutils import asMp4Str
-from webct.components.sim.SimSession import Sim
+from webct.components.sim.Jobs import Job, JobQueueFull, jobs
+from webct.components.sim.SimSession import Sim, SimSession
 import logging as log
 
 @bp.route("/capture/set", methods=["PUT"])
@@ -24,14 +26,14 @@ def getCapture() -> Response:
 	return jsonify(response)
 
 
-@bp.route("/capture/preview/get")
-def getPreview() -> dict:
-	sim = Sim(session)
+def previewScan(sim: SimSession, job: Optional[Job] = None) -> dict:
 	log.info(f"[{sim._sid}] Requesting animated scan")
-	projections = sim.allProjections()
+	projections = sim.allProjections(job.scanProgress(0, 0.9) if job is not None else None)
 
 	# Sending the animation as gifs are too large, and therefore don't work properly.
 	# Instead, we will create a video file in-memory and use flask to serve it.
+	if job is not None:
+		job.report(0.9, "Encoding scan video")
 	video = asMp4Str(projections)
 
 	log.info(f"Created {video.__sizeof__()/1024:.2f}kb animated scan preview video.")
@@ -40,3 +42,20 @@ def getPreview() -> dict:
 		"width": projections[0].shape[1],
 		"gif_str": video,
 	}
+
+
+@bp.route("/capture/preview/get")
+def getPreview() -> dict:
+	return previewScan(Sim(session))
+
+
+@bp.route("/capture/preview/job")
+def getPreviewJob() -> Response:
+	"""Start an animated scan preview in the background. Progress and the
+	result are fetched from `/sim/job/<id>`."""
+	sim = Sim(session)
+	try:
+		job = jobs.submit(sim._sid, "scan", lambda job: previewScan(sim, job))
+	except JobQueueFull:
+		return Response(None, 503)
+	return jsonify(job.to_json()), 202
@@ -9,9 +9,18 @@ from flask.wrappers import Response
 from PIL import Image
 import numpy as np
 from webct.blueprints.preview import bp
+from webct.components.Beam import BeamFromJson
+from webct.components.Capture import CaptureParameters
+from webct.components.Detector import DetectorParameters
+from webct.components.Reconstruction import ReconstructionFromJson
+from webct.components.Samples import SampleSettings
 from webct.components.imgutils import asPngStr
 from webct.components.sim.Download import DownloadResource, DownloadStatus
-from webct.components.sim.SimSession import Sim
+from webct.components.sim.Jobs import JobQueueFull, JobStatus, jobs
+from webct.components.sim.SimSession import Sim, SimSession
+
+# Longest time a job status request waits for the job to change [s]
+max_job_wait = 30.0
 
 
 def saveGif(array: np.ndarray) -> None:
@@ -46,57 +55,104 @@ def getHistImage(array:np.ndarray, bins:List[float]) -> str:
 	byteStream.seek(0)
 	return str(b64encode(byteStream.read()))[2:-1]
 
-@bp.route("/sim/preview/get")
-def getPreviews() -> Response:
-	then = monotonic()
-	sim = Sim(session)
 
-	projection = sim.projection()
-	delta = monotonic() - then
+def previewProjection(sim: SimSession, projection: np.ndarray, delta: float, render: bool = True) -> dict:
+	"""Encode a projection preview, alongside the layout and scene.
+
+	Coarse previews pass `render=False`, reusing the last layout and scene
+	rather than rendering them with the full detector. The scene is then None
+	until it has been rendered once.
+	"""
 	log_projection = np.log(projection)
 
-	hist, bins = sim.transmission_histogram()
+	hist, bins = sim.transmission_histogram(projection)
 	histimgstr = getHistImage(projection, bins)
 
 	log.info(f"[{sim._sid}] Encoding projection preview")
 	projectionstr = asPngStr(projection)
 	log_projectionstr = asPngStr(log_projection)
 
-	layout = sim.layout()
+	layout = sim.layout(render)
 	log.info(f"[{sim._sid}] Encoding layout preview")
 	layoutstr = asPngStr(layout)
 
-	scene = sim.scene()
-	log.info(f"[{sim._sid}] Encoding scene preview")
-	scenestr = asPngStr(scene)
-
-	return jsonify(
-		{
-			"time": delta,
-			"projection": {
-				"image": {
-					"raw": projectionstr,
-					"log": log_projectionstr,
-				},
-				"height": projection.shape[0],
-				"width": projection.shape[1],
-				"transmission": {
-					"hist": hist,
-					"image": histimgstr,
-				}
-			},
-			"layout": {
-				"image": layoutstr,
-				"height": layout.shape[0],
-				"width": layout.shape[1],
+	scene = sim.scene(render)
+	if scene is not None:
+		log.info(f"[{sim._sid}] Encoding scene preview")
+		scenestr = asPngStr(scene)
+
+	return {
+		"time": delta,
+		"projection": {
+			"image": {
+				"raw": projectionstr,
+				"log": log_projectionstr,
 			},
-			"scene": {
-				"image": scenestr,
-				"height": scene.shape[0],
-				"width": scene.shape[1],
+			"height": projection.shape[0],
+			"width": projection.shape[1],
+			"transmission": {
+				"hist": hist,
+				"image": histimgstr,
 			}
+		},
+		"layout": {
+			"image": layoutstr,
+			"height": layout.shape[0],
+			"width": layout.shape[1],
+		},
+		"scene": None if scene is None else {
+			"image": scenestr,
+			"height": scene.shape[0],
+			"width": scene.shape[1],
 		}
+	}
+
+
+@bp.route("/sim/preview/get")
+def getPreviews() -> Response:
+	"""Returns projection, layout, and scene previews.
+
+	With `progressive=1`, a coarse projection is returned straight away along
+	with a `refine` job, whose result is the full resolution preview.
+	"""
+	then = monotonic()
+	sim = Sim(session)
+
+	if request.args.get("progressive", 0, type=int):
+		projection, full = sim.coarseProjection()
+		preview = previewProjection(sim, projection, monotonic() - then, render=full)
+		preview["refine"] = None
+		if not full:
+			def refine(job) -> dict:
+				tik = monotonic()
+				return previewProjection(sim, sim.projection(), monotonic() - tik)
+			try:
+				preview["refine"] = jobs.submit(sim._sid, "preview", refine).to_json()
+			except JobQueueFull:
+				log.warning(f"[{sim._sid}] Job queue is full, unable to refine preview")
+		return jsonify(preview)
+
+	projection = sim.projection()
+	return jsonify(previewProjection(sim, projection, monotonic() - then))
+
+
+@bp.route("/sim/config/set", methods=["PUT"])
+def setConfig() -> Response:
+	"""Set any subset of beam, detector, samples, capture, and reconstruction
+	parameters in a single update."""
+	data = request.get_json()
+	if data is None:
+		return Response(None, 400)
+
+	simdata = Sim(session)
+	simdata.configure(
+		beam=BeamFromJson(data["beam"]) if "beam" in data else None,
+		detector=DetectorParameters.from_json(data["detector"]) if "detector" in data else None,
+		samples=SampleSettings.from_json(data["samples"]) if "samples" in data else None,
+		capture=CaptureParameters.from_json(data["capture"]) if "capture" in data else None,
+		recon=ReconstructionFromJson(data["recon"]) if "recon" in data else None,
 	)
+	return Response(None, 200)
 
 
 @bp.route("/sim/download/prep", methods=["PUT"])
@@ -118,6 +174,59 @@ def getDownloadPrepare():
 	return Response(None, 200)
 
 
+@bp.route("/sim/download/job", methods=["PUT"])
+def getDownloadJob() -> Response:
+	"""Prepare a download in the background. Once the job is done, the file
+	is fetched from the download endpoint."""
+	data = request.get_json()
+	if data is None:
+		data = {"resource":"ALL_PROJECTIONS", "format":"TIFF_ZIP"}
+
+	sim = Sim(session)
+	resource = DownloadResource.from_json(data)
+
+	def prepare(job) -> dict:
+		log.info(f"[{sim._sid}] Preparing download")
+		if not sim.download.prepare(resource, job.report):
+			raise RuntimeError("Failed to prepare download.")
+		return {"resource": resource.Resource.value, "format": resource.Format.value}
+
+	try:
+		job = jobs.submit(sim._sid, "download", prepare)
+	except JobQueueFull:
+		return Response(None, 503)
+	return jsonify(job.to_json()), 202
+
+
+@bp.route("/sim/job/<id>", methods=["GET"])
+def getJob(id: str) -> Response:
+	"""Returns the status of a job. If `since` is given a revision, waits for
+	the job to change past it, to subscribe to progress by long-polling."""
+	sim = Sim(session)
+	job = jobs.get(id, sim._sid)
+	if job is None:
+		return Response(None, 404)
+
+	since = request.args.get("since", type=int)
+	if since is not None:
+		job.wait(since, min(request.args.get("timeout", max_job_wait, type=float), max_job_wait))
+	return jsonify(job.to_json())
+
+
+@bp.route("/sim/job/<id>/result", methods=["GET"])
+def getJobResult(id: str) -> Response:
+	sim = Sim(session)
+	job = jobs.get(id, sim._sid)
+	if job is None:
+		return Response(None, 404)
+
+	if job.status == JobStatus.FAILED:
+		return Response(job.error, 500)
+	elif job.status != JobStatus.DONE:
+		return Response(job.status.value, 425)
+	return jsonify(job.result)
+
+
 @bp.route("/sim/download/status", methods=["GET"])
 def getDownloadStatus() -> Response:
 	sim = Sim(session)
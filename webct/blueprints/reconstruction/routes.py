@@ -1,10 +1,12 @@
+from typing import Optional
 from flask import jsonify, request, session
 from flask.wrappers import Response
 import numpy as np
 from webct.blueprints.reconstruction import bp
 from webct.components.Reconstruction import ReconstructionFromJson
 from webct.components.imgutils import asPngStr, asMp4Str, asDisplaySinogram
-from webct.components.sim.SimSession import Sim
+from webct.components.sim.Jobs import Job, JobQueueFull, jobs
+from webct.components.sim.SimSession import Sim, SimSession
 import logging as log
 
 @bp.route("/recon/set", methods=["PUT"])
@@ -43,12 +45,12 @@ def createSliceVideo(array: np.ndarray) -> str:
 	return asMp4Str(arr)
 
 
-@bp.route("/recon/preview/get")
-def getReconstruction() -> dict:
-	sim = Sim(session)
-	recon = sim.getReconstruction()
+def previewReconstruction(sim: SimSession, job: Optional[Job] = None) -> dict:
+	recon = sim.getReconstruction(job.scanProgress(0, 0.6) if job is not None else None)
 
 	log.info(f"[{sim._sid}] Encoding reconstruction video")
+	if job is not None:
+		job.report(0.8, "Encoding videos")
 	reconVideo = asMp4Str(recon)
 	proj = sim.projection()
 	log.info(f"[{sim._sid}] Encoding slice video")
@@ -83,3 +85,20 @@ def getReconstruction() -> dict:
 			"width": reconSlice.shape[1]
 		}
 	}
+
+
+@bp.route("/recon/preview/get")
+def getReconstruction() -> dict:
+	return previewReconstruction(Sim(session))
+
+
+@bp.route("/recon/preview/job")
+def getReconstructionJob() -> Response:
+	"""Start a reconstruction preview in the background. Progress and the
+	result are fetched from `/sim/job/<id>`."""
+	sim = Sim(session)
+	try:
+		job = jobs.submit(sim._sid, "reconstruction", lambda job: previewReconstruction(sim, job))
+	except JobQueueFull:
+		return Response(None, 503)
+	return jsonify(job.to_json()), 202
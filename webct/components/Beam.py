@@ -2,7 +2,7 @@
 
 from dataclasses import dataclass
 from functools import cache
-from typing import List, Tuple, cast
+from typing import List, Optional, Tuple, cast
 from webct import Element
 from enum import Enum
 from enum import unique
@@ -335,3 +335,96 @@ def generateSpectra(beam: BeamParameters) -> Tuple[Spectra, Spectra]:
 			raise NotImplementedError("Other beam spectra generators are not implemented.")
 	else:
 		raise ValueError("Unsupported beam type.")
+
+
+# Attenuators used to judge the error of a compressed spectrum, as pairs of
+# element and thickness [mm].
+compression_references: Tuple[Tuple[Element, mm], ...] = ((Element.Al, 1), (Element.Al, 10), (Element.Cu, 1))
+
+
+@dataclass(frozen=True)
+class SpectrumError:
+	bins: int  # Number of energy bins after compression
+	mean_energy: float  # Relative error in mean photon energy
+	attenuation: float  # Largest relative error in transmission through the reference attenuators
+
+
+def _mergeBins(energies: np.ndarray, photons: np.ndarray, bins: int) -> Tuple[np.ndarray, np.ndarray]:
+	"""Merge neighbouring bins into groups carrying roughly equal detected
+	energy. Each group sits at the photon weighted mean energy of its bins, so
+	the number of photons and the mean energy are kept."""
+	signal = photons * energies
+	before = np.cumsum(signal) - signal
+	group = np.minimum((before / signal.sum() * bins).astype(int), bins - 1)
+
+	counts = np.bincount(group, weights=photons, minlength=bins)
+	totals = np.bincount(group, weights=photons * energies, minlength=bins)
+	used = counts > 0
+	return totals[used] / counts[used], counts[used]
+
+
+def _transmissions(energies: np.ndarray, photons: np.ndarray) -> np.ndarray:
+	"""Detected fraction of the beam through each reference attenuator."""
+	signal = photons * energies
+	transmitted = []
+	for element, thickness in compression_references:
+		mu = xp.get_mu(element.value)
+		attenuation = np.asarray([mu(energy) for energy in energies], dtype=float)
+		transmitted.append((signal * np.exp(-attenuation * thickness / 10)).sum() / signal.sum())
+	return np.asarray(transmitted)
+
+
+@cache
+def compressSpectra(spectra: Spectra, bins: int, tolerance: Optional[float] = None) -> Tuple[Spectra, SpectrumError]:
+	"""Reduce the number of energy bins in a spectrum.
+
+	Empty bins are dropped, and the rest merged into at most `bins` groups.
+	Simulators raytrace each bin, so fewer bins give faster previews.
+
+	Args:
+		spectra (Spectra): Spectrum to compress.
+		bins (int): Number of bins to aim for.
+		tolerance (float, optional): Largest relative error in transmission
+			through the reference attenuators. The number of bins is doubled
+			until the error is within tolerance. Defaults to no limit.
+
+	Returns:
+		Tuple[Spectra, SpectrumError]: The compressed spectrum, and the error it introduced.
+	"""
+	energies = np.asarray(spectra.energies, dtype=float)
+	photons = np.asarray(spectra.photons, dtype=float)
+	keep = (photons > 0) & (energies > 0)
+	energies = energies[keep]
+	photons = photons[keep]
+
+	if len(energies) == 0:
+		return spectra, SpectrumError(len(spectra.energies), 0, 0)
+
+	try:
+		reference = _transmissions(energies, photons)
+	except ValueError:
+		# Energies outside of the attenuation tables, errors cannot be judged.
+		log.warning("Unable to evaluate spectrum compression error")
+		reference = None
+
+	mean = (photons * energies).sum() / photons.sum()
+	while True:
+		merged_energies, merged_photons = _mergeBins(energies, photons, bins)
+		mean_error = abs((merged_photons * merged_energies).sum() / merged_photons.sum() - mean) / mean
+		attenuation_error = 0.0
+		if reference is not None:
+			attenuation_error = float(np.max(np.abs(_transmissions(merged_energies, merged_photons) - reference) / reference))
+
+		if tolerance is None or reference is None or attenuation_error <= tolerance or bins >= len(energies):
+			break
+		bins *= 2
+
+	error = SpectrumError(len(merged_energies), float(mean_error), attenuation_error)
+	log.info(f"Compressed spectrum from {len(spectra.energies)} to {error.bins} bins, {error.attenuation:.2%} transmission error")
+	return Spectra(
+		energies=tuple(merged_energies),
+		photons=tuple(merged_photons),
+		kerma=spectra.kerma,
+		flu=spectra.flu,
+		emean=spectra.emean,
+	), error
@@ -0,0 +1,96 @@
+"""Dependency graph of results cached by a session.
+
+Each artifact lists the parameters and other artifacts it is computed from.
+Parameters carry a version, bumped whenever they change, and an artifact is
+stored alongside the versions it was computed with. An artifact is fresh
+while none of the versions it depends on have changed, so a parameter change
+only invalidates the artifacts that actually depend on it.
+"""
+
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Iterable, Optional, Tuple
+
+# Parameters artifacts may depend on. The beam is split in two, as noise is
+# applied after simulating, so the dose only affects noisy results.
+PARAMETERS = (
+	"beam",  # Beam parameters other than the dose, and so the spectrum
+	"dose",  # Exposure, tube current or flux, and whether noise is enabled
+	"detector",
+	"samples",
+	"capture",
+	"recon",
+)
+
+
+@dataclass(frozen=True)
+class Artifact:
+	parameters: Tuple[str, ...] = ()
+	artifacts: Tuple[str, ...] = ()
+
+
+ARTIFACTS: Dict[str, Artifact] = {
+	# Noise-free images, noise is applied on request from the dose.
+	"projection": Artifact(("beam", "detector", "samples", "capture")),
+	# A single projection with the full spectrum, for downloads.
+	"full_projection": Artifact(("beam", "detector", "samples", "capture")),
+	"projections": Artifact(("beam", "detector", "samples", "capture")),
+	# The white image is in absolute terms, so scales with the exposure.
+	"flatfield": Artifact(("beam", "dose", "detector", "capture")),
+	"scene": Artifact(("beam", "detector", "samples", "capture")),
+	"layout": Artifact(("beam", "detector", "capture")),
+	# Reconstructions are of noisy projections.
+	"reconstruction": Artifact(("dose", "recon"), ("projections",)),
+}
+
+
+def _closure(name: str) -> FrozenSet[str]:
+	"""Every parameter an artifact depends on, directly or through other artifacts."""
+	artifact = ARTIFACTS[name]
+	parameters = set(artifact.parameters)
+	for dependency in artifact.artifacts:
+		parameters |= _closure(dependency)
+	return frozenset(parameters)
+
+
+DEPENDENCIES: Dict[str, FrozenSet[str]] = {name: _closure(name) for name in ARTIFACTS}
+
+
+class ArtifactGraph:
+	"""Tracks which of a session's artifacts are fresh.
+
+	Not thread safe, callers must hold the session's parameter lock.
+	"""
+
+	def __init__(self) -> None:
+		self._versions: Dict[str, int] = {parameter: 0 for parameter in PARAMETERS}
+		self._computed: Dict[str, Tuple[int, ...]] = {}
+
+	def invalidate(self, parameters: Iterable[str]) -> None:
+		"""Record that parameters have changed."""
+		for parameter in parameters:
+			self._versions[parameter] += 1
+
+	def affected(self, parameters: Iterable[str]) -> FrozenSet[str]:
+		"""Artifacts invalidated by a change to the given parameters."""
+		parameters = set(parameters)
+		return frozenset(name for name, dependencies in DEPENDENCIES.items() if dependencies & parameters)
+
+	def version(self, name: str) -> Tuple[int, ...]:
+		"""Versions of every parameter an artifact depends on. Take this before
+		computing an artifact, and pass it to `store` once it is done."""
+		return tuple(self._versions[parameter] for parameter in sorted(DEPENDENCIES[name]))
+
+	def store(self, name: str, version: Tuple[int, ...]) -> None:
+		"""Record that an artifact was computed with the given parameter versions.
+		If parameters changed meanwhile, the artifact stays stale."""
+		self._computed[name] = version
+
+	def fresh(self, name: str) -> bool:
+		return self._computed.get(name) == self.version(name)
+
+	def reset(self, name: Optional[str] = None) -> None:
+		"""Forget an artifact was computed, or all artifacts if no name is given."""
+		if name is None:
+			self._computed = {}
+		else:
+			self._computed.pop(name, None)
@@ -10,6 +10,7 @@ from PIL import Image
 from zipfile import ZipFile
 import shutil
 from datetime import datetime
+from typing import Callable, Optional
 import logging as log
 
 # Circular import, so we can't do typing unless we refactor SimSession...
@@ -21,6 +22,8 @@ class ResourceType(Enum):
 	ALL_PROJECTION = "ALL_PROJECTIONS"
 	RECON_SLICE = "RECON_SLICE"
 	RECONSTRUCTION = "RECON"
+	FLATFIELD = "FLATFIELD"
+	DARKFIELD = "DARKFIELD"
 
 
 class ResourceFormat(Enum):
@@ -61,22 +64,28 @@ class DownloadStatus(Enum):
 class DownloadPrepper():
 
 	@staticmethod
-	def simulate(sim, resource:DownloadResource) -> bool:
+	def simulate(sim, resource:DownloadResource, progress:Optional[Callable]=None) -> bool:
 		if not DownloadPrepper.checkCompat(resource):
 			return False
 
 		# Simulate request
 		if resource.Resource == ResourceType.ALL_PROJECTION:
-			sim.allProjections()
+			sim.allProjections(progress)
 
 		elif resource.Resource == ResourceType.PROJECTION:
-			sim.projection()
+			sim.projection(preview=False)
 
 		elif resource.Resource == ResourceType.RECON_SLICE:
-			sim.getReconstruction()
+			sim.getReconstruction(progress)
 
 		elif resource.Resource == ResourceType.RECONSTRUCTION:
-			sim.getReconstruction()
+			sim.getReconstruction(progress)
+
+		elif resource.Resource == ResourceType.FLATFIELD:
+			sim.flatfield
+
+		elif resource.Resource == ResourceType.DARKFIELD:
+			sim.darkfield
 
 		return True
 
@@ -106,9 +115,15 @@ class DownloadPrepper():
 			elif resource.Resource == ResourceType.RECONSTRUCTION:
 				npy = sim.getReconstruction()
 
+			elif resource.Resource == ResourceType.FLATFIELD:
+				npy = sim.flatfield
+
+			elif resource.Resource == ResourceType.DARKFIELD:
+				npy = sim.darkfield
+
 			else:
 			# elif resource.Resource == ResourceType.PROJECTION:
-				npy = sim.projection()
+				npy = sim.projection(preview=False)
 
 			np.save(location, npy)
 			return True
@@ -119,13 +134,23 @@ class DownloadPrepper():
 				tf.imwrite(location, recon[recon.shape[0]//2])
 
 			elif resource.Resource == ResourceType.PROJECTION:
-				tf.imwrite(location, sim.projection())
+				tf.imwrite(location, sim.projection(preview=False))
 
 			elif resource.Resource == ResourceType.ALL_PROJECTION:
-				tf.imwrite(location, sim.allProjections())
+				# Stacks are written a slice at a time, so memory-mapped stacks
+				# are never read into memory as a whole.
+				stack = sim.allProjections()
+				tf.imwrite(location, iter(stack), shape=stack.shape, dtype=stack.dtype)
 
 			elif resource.Resource == ResourceType.RECONSTRUCTION:
-				tf.imwrite(location, sim.getReconstruction(),imagej=True)
+				stack = sim.getReconstruction()
+				tf.imwrite(location, iter(stack), shape=stack.shape, dtype=stack.dtype, imagej=True)
+
+			elif resource.Resource == ResourceType.FLATFIELD:
+				tf.imwrite(location, sim.flatfield)
+
+			elif resource.Resource == ResourceType.DARKFIELD:
+				tf.imwrite(location, sim.darkfield)
 			else:
 				return False
 
@@ -138,11 +163,18 @@ class DownloadPrepper():
 				array = sim.getReconstruction()
 				array = array[array.shape[0]//2]
 
+			elif resource.Resource == ResourceType.FLATFIELD:
+				array = sim.flatfield
+
+			elif resource.Resource == ResourceType.DARKFIELD:
+				array = sim.darkfield
+
 			# elif resource.Resource == ResourceType.PROJECTION:
 			else:
-				array = sim.projection()
+				array = sim.projection(preview=False)
 
-			array = (array - array.min()) / (array.max() - array.min())
+			# Avoid dividing by zero for uniform images, such as the dark field.
+			array = (array - array.min()) / max(array.max() - array.min(), 1e-12)
 			array = (array * 255).astype(np.uint8)
 
 			Image.fromarray(array).save(location)
@@ -175,7 +207,7 @@ class DownloadPrepper():
 	def checkCompat(resource:DownloadResource):
 
 		# Single images
-		if resource.Resource == ResourceType.PROJECTION or resource.Resource == ResourceType.RECON_SLICE:
+		if resource.Resource in (ResourceType.PROJECTION, ResourceType.RECON_SLICE, ResourceType.FLATFIELD, ResourceType.DARKFIELD):
 			# Download supports single tiff, numpy, and jpeg
 			if resource.Format == ResourceFormat.TIFF_STACK:
 				return True
@@ -209,7 +241,15 @@ class DownloadManager:
 		self._status = DownloadStatus.WAITING
 		self._result_path = None
 
-	def prepare(self, resource:DownloadResource) -> bool:
+	def prepare(self, resource:DownloadResource, progress:Optional[Callable[[float, str], None]]=None) -> bool:
+		"""Simulate and package a resource for download. This is blocking, so
+		should be run as a job from web requests.
+
+		Args:
+			resource (DownloadResource): Resource and format to prepare.
+			progress (Callable[[float, str], None], optional): Called with the
+				fraction completed and the current step.
+		"""
 		if self._working:
 			return False
 		else:
@@ -225,8 +265,13 @@ class DownloadManager:
 			self._status = DownloadStatus.SIMULATING
 
 			self._working = True
+			scanProgress = None
+			if progress is not None:
+				progress(0.0, "Simulating")
+				# Simulation takes the bulk of the time, packaging the rest.
+				scanProgress = lambda projections, update: progress(0.8 * update.done / update.total, "Simulating")
 			try:
-				simmed = DownloadPrepper.simulate(self._session, self._resource)
+				simmed = DownloadPrepper.simulate(self._session, self._resource, scanProgress)
 			except Exception as e:
 				simmed = False
 
@@ -237,6 +282,8 @@ class DownloadManager:
 
 			# Package requested data
 			self._status = DownloadStatus.PACKAGING
+			if progress is not None:
+				progress(0.8, "Packaging")
 
 			path = self.location(resource)
 			makedirs(path.parent, exist_ok=True)
@@ -281,5 +328,9 @@ class DownloadManager:
 			name = "centre-slice"
 		elif resource.Resource == ResourceType.RECONSTRUCTION:
 			name = "reconstruction"
+		elif resource.Resource == ResourceType.FLATFIELD:
+			name = "flatfield"
+		elif resource.Resource == ResourceType.DARKFIELD:
+			name = "darkfield"
 
 		return Path(f"./output/{self._result_path}/file").with_name(name).with_suffix(ext)
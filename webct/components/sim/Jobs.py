@@ -0,0 +1,183 @@
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from random import Random
+from threading import Condition, Lock
+from time import monotonic
+from typing import Any, Callable, Dict, Optional
+import logging as log
+
+import numpy as np
+from webct.components.sim.clients.SimClient import SimProgress
+
+# Number of jobs run at once. Jobs mostly wait on simulator processes, so this
+# bounds how many sessions can queue work on the simulators, not CPU use.
+job_workers = 4
+
+# Largest number of jobs waiting or running, beyond which new jobs are refused
+max_jobs = 32
+
+# Time a finished job's result is kept before it is discarded [s]
+job_retention = 600.0
+
+rng = Random()
+
+
+class JobStatus(Enum):
+	QUEUED = "QUEUED"
+	RUNNING = "RUNNING"
+	DONE = "DONE"
+	FAILED = "FAILED"
+
+
+class JobQueueFull(RuntimeError):
+	pass
+
+
+class Job:
+	"""A unit of long-running work, such as a scan, reconstruction, or download.
+
+	Progress is reported by the running task through `report`. Each report
+	bumps the job's revision, so clients can wait for the next change.
+	"""
+
+	def __init__(self, id: str, sid: int, kind: str) -> None:
+		self.id = id
+		self.sid = sid
+		self.kind = kind
+		self.status = JobStatus.QUEUED
+		self.progress = 0.0
+		self.message = "Queued"
+		self.result: Any = None
+		self.error: Optional[str] = None
+		self.revision = 0
+		self.finished: Optional[float] = None
+		self._changed = Condition()
+
+	def report(self, progress: float, message: Optional[str] = None) -> None:
+		"""Update the job's progress.
+
+		Args:
+			progress (float): Fraction of the job completed, between 0 and 1.
+			message (str, optional): Description of the current step.
+		"""
+		with self._changed:
+			self.progress = min(max(progress, 0.0), 1.0)
+			if message is not None:
+				self.message = message
+			self.revision += 1
+			self._changed.notify_all()
+
+	def scanProgress(self, start: float = 0.0, end: float = 1.0, message: str = "Simulating projections") -> Callable[[np.ndarray, SimProgress], None]:
+		"""Returns a progress callback for `SimSession.allProjections`, mapping
+		the scan onto the [start, end] range of this job's progress."""
+		def progress(projections: np.ndarray, update: SimProgress) -> None:
+			self.report(start + (end - start) * update.done / update.total, message)
+		return progress
+
+	def wait(self, revision: int, timeout: float) -> int:
+		"""Block until the job changes past a revision, or finishes.
+
+		Returns:
+			int: The job's current revision.
+		"""
+		with self._changed:
+			self._changed.wait_for(
+				lambda: self.revision > revision or self.status in (JobStatus.DONE, JobStatus.FAILED),
+				timeout,
+			)
+			return self.revision
+
+	def _run(self, task: Callable[["Job"], Any]) -> None:
+		with self._changed:
+			self.status = JobStatus.RUNNING
+			self.message = "Running"
+			self.revision += 1
+			self._changed.notify_all()
+
+		try:
+			result = task(self)
+		except Exception as e:
+			log.exception(f"[{self.sid}] Job {self.id} ({self.kind}) failed")
+			with self._changed:
+				self.status = JobStatus.FAILED
+				self.error = str(e)
+				self.message = "Failed"
+				self.finished = monotonic()
+				self.revision += 1
+				self._changed.notify_all()
+			return
+
+		with self._changed:
+			self.result = result
+			self.status = JobStatus.DONE
+			self.progress = 1.0
+			self.message = "Done"
+			self.finished = monotonic()
+			self.revision += 1
+			self._changed.notify_all()
+
+	def to_json(self) -> dict:
+		return {
+			"id": self.id,
+			"kind": self.kind,
+			"status": self.status.value,
+			"progress": self.progress,
+			"message": self.message,
+			"error": self.error,
+			"revision": self.revision,
+		}
+
+
+class JobManager:
+	"""Runs jobs on a bounded pool of threads, so HTTP workers never block on
+	long simulations."""
+
+	def __init__(self) -> None:
+		self._executor = ThreadPoolExecutor(max_workers=job_workers, thread_name_prefix="WCT-Job")
+		self._jobs: Dict[str, Job] = {}
+		self._lock = Lock()
+
+	def submit(self, sid: int, kind: str, task: Callable[[Job], Any]) -> Job:
+		"""Queue a task to run in the background.
+
+		Args:
+			sid (int): Session the job belongs to.
+			kind (str): Type of job, such as "scan" or "download".
+			task (Callable[[Job], Any]): Function run with the job, used to
+				report progress. Its return value becomes the job's result.
+
+		Raises:
+			JobQueueFull: Too many jobs are waiting or running.
+		"""
+		with self._lock:
+			self._prune()
+			active = [job for job in self._jobs.values() if job.finished is None]
+			if len(active) >= max_jobs:
+				raise JobQueueFull(f"{len(active)} jobs are already queued or running.")
+
+			id = f"{rng.randint(0, 2**48):012x}"
+			while id in self._jobs:
+				id = f"{rng.randint(0, 2**48):012x}"
+			job = Job(id, sid, kind)
+			self._jobs[id] = job
+
+		log.info(f"[{sid}] Queued {kind} job {id}")
+		self._executor.submit(job._run, task)
+		return job
+
+	def get(self, id: str, sid: int) -> Optional[Job]:
+		"""Returns a job, if it exists and belongs to the session."""
+		with self._lock:
+			job = self._jobs.get(id)
+		if job is None or job.sid != sid:
+			return None
+		return job
+
+	def _prune(self) -> None:
+		"""Drop finished jobs past their retention. Must hold the lock."""
+		now = monotonic()
+		for id in [id for id, job in self._jobs.items() if job.finished is not None and now - job.finished > job_retention]:
+			del self._jobs[id]
+
+
+jobs = JobManager()
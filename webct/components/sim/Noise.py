@@ -0,0 +1,126 @@
+"""Photon counting noise, applied to noise-free projections as a post-process.
+
+Transmission images do not depend on the number of photons in the beam, so
+the simulator renders noise-free projections and noise is added here. Changes
+to the dose (exposure, tube current, or flux) then only need the projections
+to be re-noised, rather than re-simulated.
+"""
+
+from dataclasses import dataclass, replace
+from typing import Optional, cast
+
+import numpy as np
+
+from webct.components.Beam import BeamParameters, LabBeam, MedBeam, Spectra, SynchBeam
+from webct.components.Capture import CaptureParameters
+from webct.components.Detector import DetectorParameters
+
+# Seed for noise, so the same parameters always give the same projections
+noise_seed = 0
+
+# Above this many expected photons, Poisson noise is approximated as normal.
+# This is far quicker to sample, and indistinguishable at these counts.
+normal_threshold = 1000.0
+
+
+@dataclass(frozen=True)
+class NoiseParameters:
+	photons: float  # Mean number of photons reaching a pixel without a sample
+	seed: int
+
+
+def withoutDose(beam: BeamParameters) -> BeamParameters:
+	"""Returns beam parameters with dose related fields reset.
+
+	Two beams that compare equal after this only differ by noise, so share the
+	same noise-free projections.
+	"""
+	if isinstance(beam, LabBeam):
+		return replace(beam, enableNoise=False, exposure=1, intensity=1)
+	elif isinstance(beam, MedBeam):
+		return replace(beam, enableNoise=False, mas=1)
+	elif isinstance(beam, SynchBeam):
+		return replace(beam, enableNoise=False, exposure=1, flux=1)
+	return replace(beam, enableNoise=False)
+
+
+def withoutFluence(spectra: Spectra) -> Spectra:
+	"""Returns a spectrum normalised to one photon, with the kerma and fluence reset.
+
+	Photon counts scale with the dose, but transmission images only depend on
+	the shape of the spectrum. Values are rounded, so spectra scaled by
+	different doses compare equal despite floating point error, including
+	the photon weighted energies of compressed spectra.
+	"""
+	total = sum(spectra.photons)
+	if total <= 0:
+		return replace(spectra, kerma=0, flu=0)
+	energies = tuple(float(f"{energy:.12g}") for energy in spectra.energies)
+	photons = tuple(float(f"{photon / total:.12g}") for photon in spectra.photons)
+	return replace(spectra, energies=energies, photons=photons, kerma=0, flu=0)
+
+
+def noiseParameters(beam: BeamParameters, detector: DetectorParameters, capture: CaptureParameters) -> Optional[NoiseParameters]:
+	"""Returns the noise for a beam, or None if noise is disabled."""
+	if not beam.enableNoise:
+		return None
+
+	if isinstance(beam, LabBeam) or isinstance(beam, MedBeam):
+		mAs = 1
+		if isinstance(beam, LabBeam):
+			lab = cast(LabBeam, beam)
+			mAs = (lab.intensity / 1000) * lab.exposure
+		else:
+			med = cast(MedBeam, beam)
+			mAs = med.mas
+
+		electron_charge = 1.602e-19  # [C]
+		photons_per_cm2 = mAs * (1.0e-3 / electron_charge) * (1 / ((capture.SDD * 10) ** 2))
+	elif isinstance(beam, SynchBeam):
+		# flux is x10^10
+		photons_per_cm2 = beam.flux * beam.exposure * 10e10
+	else:
+		return None
+
+	# pixel size is in mm
+	pixel_area = (detector.binned_pixel_size / 10) ** 2
+	return NoiseParameters(photons_per_cm2 * pixel_area, noise_seed)
+
+
+def applyNoise(clean: np.ndarray, noise: NoiseParameters, first: int = 0, out: Optional[np.ndarray] = None) -> np.ndarray:
+	"""Apply photon counting noise to transmission images.
+
+	Each image is seeded by its index, so a projection is noised identically
+	whether on its own or as part of a scan.
+
+	Args:
+		clean (np.ndarray): A noise-free image, or a stack of images.
+		noise (NoiseParameters): Photon count and seed to use.
+		first (int, optional): Index of the first image in `clean`. Defaults to 0.
+		out (np.ndarray, optional): float32 array of the same shape to write
+			into, such as a memory-mapped file. Defaults to a new array.
+
+	Returns:
+		np.ndarray: A float32 array of noisy transmission images.
+	"""
+	images = clean if clean.ndim == 3 else clean[np.newaxis]
+	result = np.empty(clean.shape, dtype=np.float32) if out is None else out
+	out = result if clean.ndim == 3 else result[np.newaxis]
+
+	for i in range(images.shape[0]):
+		rng = np.random.default_rng((noise.seed, first + i))
+		expected = np.maximum(images[i], 0, dtype=np.float32) * np.float32(noise.photons)
+
+		# Sample normally distributed counts for the whole image, then replace
+		# low count pixels with true Poisson samples.
+		counts = rng.standard_normal(expected.shape, dtype=np.float32)
+		counts *= np.sqrt(expected)
+		counts += expected
+		low = expected < normal_threshold
+		if low.any():
+			counts[low] = rng.poisson(expected[low])
+		np.maximum(counts, 0, out=counts)
+
+		np.divide(counts, np.float32(noise.photons), out=out[i])
+
+	return result
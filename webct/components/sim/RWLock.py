@@ -0,0 +1,46 @@
+from contextlib import contextmanager
+from threading import Condition, Lock
+from typing import Iterator
+
+
+class RWLock:
+	"""A reader/writer lock, allowing many readers or a single writer.
+
+	Waiting writers take priority over new readers, so a steady stream of
+	reads cannot starve a parameter change. The lock is not reentrant.
+	"""
+
+	def __init__(self) -> None:
+		self._cond = Condition(Lock())
+		self._readers = 0
+		self._writing = False
+		self._waiting = 0
+
+	@contextmanager
+	def read(self) -> Iterator[None]:
+		with self._cond:
+			self._cond.wait_for(lambda: not self._writing and self._waiting == 0)
+			self._readers += 1
+		try:
+			yield
+		finally:
+			with self._cond:
+				self._readers -= 1
+				if self._readers == 0:
+					self._cond.notify_all()
+
+	@contextmanager
+	def write(self) -> Iterator[None]:
+		with self._cond:
+			self._waiting += 1
+			try:
+				self._cond.wait_for(lambda: not self._writing and self._readers == 0)
+			finally:
+				self._waiting -= 1
+			self._writing = True
+		try:
+			yield
+		finally:
+			with self._cond:
+				self._writing = False
+				self._cond.notify_all()
@@ -0,0 +1,202 @@
+"""Persistent cache of simulation results, shared by all sessions.
+
+Results are stored as `.npy` files named by a digest of every parameter they
+depend on, so identical configurations are reused across sessions and
+restarts. Cached arrays are memory mapped rather than read into memory.
+"""
+
+from dataclasses import fields, is_dataclass
+from enum import Enum
+from threading import Lock
+from typing import Any, Dict, Optional, Tuple
+import hashlib
+import json
+import os
+import logging
+log = logging.getLogger("ResultCache")
+
+import numpy as np
+
+from webct import model_folder, version
+from webct.components.Samples import RenderedSampleSettings
+from webct.components.sim.simulators import DetectorEffects, PathLength
+
+# Cache results on disk. Disable to always simulate.
+enable_result_cache = True
+
+# Folder results are stored in
+result_cache_folder = "./cache/results/"
+
+# Largest total size of cached results on disk [bytes]
+result_cache_size = 8 * 1024 * 1024 * 1024
+
+# Bump when simulation output changes, to invalidate existing results.
+result_cache_version = 1
+
+
+def _canonical(value: Any) -> Any:
+	"""Convert parameters into plain JSON types, so they hash the same way
+	across runs."""
+	if is_dataclass(value):
+		return {"type": type(value).__name__, **{field.name: _canonical(getattr(value, field.name)) for field in fields(value)}}
+	if isinstance(value, Enum):
+		return _canonical(value.value)
+	if isinstance(value, dict):
+		return {str(key): _canonical(item) for key, item in value.items()}
+	if isinstance(value, (list, tuple)):
+		return [_canonical(item) for item in value]
+	if isinstance(value, np.ndarray):
+		return _canonical(value.tolist())
+	if isinstance(value, (np.integer, np.floating)):
+		return _canonical(value.item())
+	if isinstance(value, float):
+		# repr round trips exactly, unlike json's formatting of some floats.
+		return repr(value)
+	if value is None or isinstance(value, (bool, int, str)):
+		return value
+	return repr(value)
+
+
+# sha1 of model files, by (path, modification time, size)
+_model_hashes: Dict[Tuple[str, int, int], str] = {}
+
+
+def _modelHash(path: str) -> str:
+	stat = os.stat(path)
+	key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+	if key not in _model_hashes:
+		with open(path, "rb") as f:
+			_model_hashes[key] = hashlib.sha1(f.read()).hexdigest()
+	return _model_hashes[key]
+
+
+def digest(kind: str, *parameters: Any) -> str:
+	"""Stable key for a result, from every parameter it depends on.
+
+	Rendered samples are also keyed by the contents of their model files, so
+	replacing a model with the same name does not return stale results.
+
+	Args:
+		kind (str): Type of result, such as "projections".
+		parameters (Any): Parameters the result was simulated with.
+	"""
+	meshes = []
+	for value in parameters:
+		if isinstance(value, RenderedSampleSettings):
+			meshes.extend(_modelHash(f"{model_folder}{sample.modelPath}") for sample in value.samples)
+
+	# Simulator options change results without changing any parameters.
+	options = [PathLength.enable_path_length, DetectorEffects.enable_detector_effects]
+
+	content = json.dumps(
+		[kind, version, result_cache_version, options, _canonical(parameters), meshes],
+		sort_keys=True, separators=(",", ":"),
+	)
+	return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+	"""Least recently used cache of arrays on disk.
+
+	Recency is tracked by file modification times, so it survives restarts.
+	Files are written under a temporary name and moved into place, so a crash
+	never leaves a partial result behind.
+	"""
+
+	def __init__(self, folder: Optional[str] = None, capacity: Optional[int] = None) -> None:
+		self.folder = result_cache_folder if folder is None else folder
+		self.capacity = result_cache_size if capacity is None else capacity
+		self._lock = Lock()
+		# Size and last use of each cached result, by key.
+		self._entries: Optional[Dict[str, Tuple[int, float]]] = None
+
+	def _path(self, key: str) -> str:
+		return os.path.join(self.folder, f"{key}.npy")
+
+	def _index(self) -> Dict[str, Tuple[int, float]]:
+		"""Scan the cache folder on first use. Must hold the lock."""
+		if self._entries is None:
+			os.makedirs(self.folder, exist_ok=True)
+			self._entries = {}
+			for entry in os.scandir(self.folder):
+				if entry.name.endswith(".npy"):
+					stat = entry.stat()
+					self._entries[entry.name[:-4]] = (stat.st_size, stat.st_mtime)
+				elif entry.name.endswith(".tmp"):
+					# Left behind by an interrupted write.
+					os.remove(entry.path)
+			log.info(f"Found {len(self._entries)} cached results ({self._size() / 1024 / 1024:.1f} MiB)")
+		return self._entries
+
+	def _size(self) -> int:
+		return sum(size for size, _ in self._entries.values())
+
+	def get(self, key: str) -> Optional[np.ndarray]:
+		"""Returns a read-only memory map of a cached result, or None if it is not cached."""
+		if not enable_result_cache:
+			return None
+
+		with self._lock:
+			entries = self._index()
+			if key not in entries:
+				return None
+			try:
+				result = np.load(self._path(key), mmap_mode="r")
+				os.utime(self._path(key))
+			except (OSError, ValueError):
+				log.exception(f"Unable to read cached result {key[:12]}, discarding it")
+				self._remove(key)
+				return None
+			entries[key] = (entries[key][0], os.stat(self._path(key)).st_mtime)
+
+		log.info(f"Result cache hit for {key[:12]}")
+		return result
+
+	def put(self, key: str, result: np.ndarray) -> None:
+		"""Store a result, evicting the least recently used results beyond the capacity."""
+		if not enable_result_cache:
+			return
+
+		if result.nbytes > self.capacity:
+			log.info(f"Not caching {key[:12]}, {result.nbytes / 1024 / 1024:.1f} MiB exceeds the cache size")
+			return
+
+		with self._lock:
+			entries = self._index()
+			path = self._path(key)
+			try:
+				with open(f"{path}.tmp", "wb") as f:
+					np.save(f, result)
+				os.replace(f"{path}.tmp", path)
+			except OSError:
+				log.exception(f"Unable to cache result {key[:12]}")
+				return
+			stat = os.stat(path)
+			entries[key] = (stat.st_size, stat.st_mtime)
+			self._evict(keep=key)
+
+		log.info(f"Cached result {key[:12]} ({result.nbytes / 1024 / 1024:.1f} MiB)")
+
+	def _evict(self, keep: str) -> None:
+		"""Remove least recently used results until within capacity. Must hold the lock."""
+		size = self._size()
+		for key, (nbytes, _) in sorted(self._entries.items(), key=lambda item: item[1][1]):
+			if size <= self.capacity:
+				break
+			if key == keep:
+				continue
+			self._remove(key)
+			size -= nbytes
+			log.info(f"Evicted cached result {key[:12]} ({nbytes / 1024 / 1024:.1f} MiB)")
+
+	def _remove(self, key: str) -> None:
+		self._entries.pop(key, None)
+		try:
+			os.remove(self._path(key))
+		except OSError:
+			# Still mapped by a session on some platforms, the file is picked up
+			# again when the folder is next scanned.
+			pass
+
+
+results = ResultCache()
@@ -1,29 +1,230 @@
+from collections import deque
+from multiprocessing.connection import Connection, wait
 from threading import Semaphore
-from random import Random
-from webct.components.sim.clients.SimClient import SimClient
+from time import monotonic
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+import math
+from webct.components.sim.clients.SimClient import (SimCancelledError, SimClient, SimProgress, SimResponse, SimThreadError, poll_interval)
 import logging as log
 
+import numpy as np
+
 processes: dict[int, SimClient] = {}
-rng = Random()
+workers: dict[int, List[SimClient]] = {}
+standby: Deque[SimClient] = deque()
 lock = Semaphore()
 
+# Number of started, idle simulator processes kept ready to replace a failed
+# client or serve a new session, so neither waits on a cold start.
+standby_count = 1
+
+# Number of simulator processes used to render a full scan, including the
+# session's own client. Helper processes mirror the session's parameters.
+worker_count = 1
+
+# Largest number of angles handed to a worker at a time. Shards shrink as the
+# scan nears completion, so a slow worker only holds back a few angles.
+shard_size = 16
 
-def getClient(session, sid:int) -> SimClient:
+
+def getClient(sid:int) -> SimClient:
+	"""Returns the simulator process of a session, starting one if needed."""
 	with lock:
-		if "tid" not in session:
-			tid = rng.randint(0, 10000)
-			while tid in processes:
-				tid = rng.randint(0, 10000)
-			session["tid"] = tid
-		tid = session["tid"]
-		if tid in processes:
-			thread: SimClient = processes[tid]
+		if sid in processes:
+			thread: SimClient = processes[sid]
 			if thread.is_alive():
 				return thread
 			else:
 				log.warning(f"Expected a process {thread.pid}, but it was dead")
+				thread.release()
+
+		processes[sid] = _spawn(sid)
+		return processes[sid]
+
+
+def getWorkers(sid:int) -> List[SimClient]:
+	"""Returns helper processes used alongside a session's client when
+	simulating all projections.
+
+	Newly started helpers have no parameters, the caller is responsible for
+	sending the current beam, detector, samples, and capture.
+	"""
+	with lock:
+		helpers = []
+		for thread in workers.get(sid, []):
+			if thread.is_alive():
+				helpers.append(thread)
+			else:
+				log.warning(f"Expected a worker process {thread.pid}, but it was dead")
+				thread.release()
+
+		while len(helpers) < worker_count - 1:
+			helpers.append(_spawn(sid))
+
+		workers[sid] = helpers
+		return helpers
+
+
+def releaseClients(sid:int) -> None:
+	"""Stop a session's simulator processes, such as when it has been idle.
+	The session starts new processes on next use."""
+	with lock:
+		threads = [thread for thread in (processes.pop(sid, None), *workers.pop(sid, [])) if thread is not None]
+	for thread in threads:
+		log.info(f"[{sid}] Stopping simulator process {thread.pid}")
+		thread.kill()
+
+
+def replaceClient(client: SimClient, sid:int) -> SimClient:
+	"""Kill a failed client, and swap a standby process in wherever it was used.
+
+	The replacement holds no parameters, the caller is responsible for sending
+	the current beam, detector, samples, and capture.
+	"""
+	client.kill()
+	with lock:
+		replacement = _spawn(sid)
+		for id, thread in processes.items():
+			if thread is client:
+				processes[id] = replacement
+		for id, helpers in workers.items():
+			workers[id] = [replacement if thread is client else thread for thread in helpers]
+	log.info(f"Replaced simulator process {client.pid} with {replacement.pid}")
+	return replacement
 
+
+def _spawn(sid:int) -> SimClient:
+	"""Take a standby process if one is alive, otherwise start a new one.
+	The standby pool is then topped up. Must be called while holding the lock."""
+	client = None
+	while standby and client is None:
+		thread = standby.popleft()
+		if thread.is_alive():
+			client = thread
+		else:
+			log.warning(f"Expected a standby process {thread.pid}, but it was dead")
+			thread.release()
+
+	if client is None:
 		# SimClient is passed the session ID for logging purposes.
-		processes[tid] = SimClient(sid)
-		processes[tid].start()
-		return processes[tid]
+		client = SimClient(sid)
+		client.start()
+	else:
+		# The child learns its session from the next config it is sent.
+		client._sid = sid
+
+	# Standby processes initialise their simulator while idle.
+	while len(standby) < standby_count:
+		thread = SimClient("standby")
+		thread.start()
+		standby.append(thread)
+	return client
+
+
+def configureClients(configs: List[Tuple[SimClient, Dict[str, Any]]]) -> None:
+	"""Send parameters to several clients, then wait for all of them, so
+	children load samples and spectra in parallel rather than in turn.
+
+	Args:
+		configs (List[Tuple[SimClient, Dict[str, Any]]]): Each client, and the
+			keyword arguments of `SimClient.setConfig` to send it.
+
+	Raises:
+		SimThreadError: A client failed or stopped responding. Clients may have
+			unread messages, and should be replaced.
+	"""
+	for client, params in configs:
+		client.sendConfig(**params)
+	for client, _ in configs:
+		client.awaitConfig()
+
+
+def _shards(projections: int, clients: int) -> Deque[Tuple[int, int]]:
+	"""Split projections into guided shards, large at first and shrinking
+	towards the end of the scan."""
+	shards: Deque[Tuple[int, int]] = deque()
+	start = 0
+	while start < projections:
+		remaining = projections - start
+		size = max(1, min(shard_size, math.ceil(remaining / (2 * clients))))
+		shards.append((start, start + size))
+		start += size
+	return shards
+
+
+def shardProjections(clients: List[SimClient], progress: Optional[Callable[[np.ndarray, SimProgress], None]] = None) -> np.ndarray:
+	"""Simulate all projections across several simulator clients.
+
+	Projections are written into shared memory allocated by the first client,
+	which is handed over to the returned stack once the scan ends. Angles are
+	split into shards that are handed to whichever client is idle, so faster
+	workers take on more of the scan. All clients must hold the same beam,
+	detector, samples, and capture.
+
+	Raises:
+		SimCancelledError: The scan was cancelled. All clients have stopped,
+			and remain usable.
+		SimThreadError: A client failed or stopped responding. Clients may have
+			unread messages, and should be replaced.
+	"""
+	name, projections = clients[0].allocateProjections()
+	shards = _shards(projections.shape[0], len(clients))
+	log.info(f"Simulating {projections.shape[0]} projections in {len(shards)} shards across {len(clients)} workers")
+
+	busy: Dict[Connection, SimClient] = {}
+	heard: Dict[Connection, float] = {}
+	started: Dict[Connection, Tuple[float, int]] = {}
+	done = 0
+	cancelled = False
+
+	def dispatch(client: SimClient) -> None:
+		if not shards:
+			return
+		start, stop = shards.popleft()
+		client.requestProjections(name, projections.shape, start, stop)
+		busy[client.conn_parent] = client
+		heard[client.conn_parent] = monotonic()
+		started[client.conn_parent] = (monotonic(), stop - start)
+
+	try:
+		for client in clients:
+			dispatch(client)
+
+		while busy:
+			for conn in wait(list(busy.keys()), timeout=poll_interval):
+				response = conn.recv()
+				heard[conn] = monotonic()
+
+				if isinstance(response, SimProgress):
+					done += response.stop - response.start
+					if progress is None:
+						continue
+					try:
+						progress(projections, SimProgress(response.start, response.stop, done, projections.shape[0]))
+					except Exception:
+						# Workers must be drained to keep their pipes in sync.
+						log.exception("Progress callback failed, ignoring further updates")
+						progress = None
+				elif response is SimResponse.DONE:
+					client = busy.pop(conn)
+					tik, count = started.pop(conn)
+					client.measure(monotonic() - tik, count)
+					dispatch(client)
+				elif response is SimResponse.CANCELLED:
+					# Remaining clients are cancelled alongside, but are drained so
+					# their pipes stay in sync.
+					cancelled = True
+					shards.clear()
+					busy.pop(conn)
+				else:
+					raise SimThreadError(f"Unexpected response from worker {busy[conn].pid}: {response}")
+
+			for conn, client in busy.items():
+				client.checkProgress(heard[conn])
+	finally:
+		# Views have been handed out, so the segment must not be reused.
+		clients[0].detachProjections(name, projections)
+
+	if cancelled:
+		raise SimCancelledError("Simulation of all projections was cancelled.")
+	return projections
@@ -1,7 +1,9 @@
+from dataclasses import replace
 from enum import Enum
 from random import Random
-from threading import Semaphore
-from typing import List, Optional, Tuple
+from threading import Lock, Semaphore, Thread
+from time import monotonic, sleep
+from typing import Any, Callable, Dict, List, Optional, Tuple
 import logging
 log = logging.getLogger("SimSession")
 
@@ -14,14 +16,45 @@ from matplotlib.figure import Figure
 from PIL import Image
 
 from webct import Element
-from webct.components.Beam import (BEAM_GENERATOR, PROJECTION, BeamParameters, Filter, LabBeam, Spectra, generateSpectra)
+from webct.components.Beam import (BEAM_GENERATOR, PROJECTION, Beam, BeamParameters, Filter, LabBeam, Spectra, compressSpectra, generateSpectra)
 from webct.components.Capture import CaptureParameters
 from webct.components.Detector import DEFAULT_LSF, SCINTILLATOR_MATERIAL, DetectorParameters, Scintillator
 from webct.components.Reconstruction import (FDKParam, ReconParameters, reconstruct, get_geometry)
 from webct.components.Samples import RenderedSampleSettings, Sample, SampleSettings
+from webct.components.sim.Artifacts import ArtifactGraph
 from webct.components.sim.Download import DownloadManager
-from webct.components.sim.clients.SimClient import SimClient, SimThreadError, SimTimeoutError
-from webct.components.sim.SimManager import getClient
+from webct.components.sim.Noise import NoiseParameters, applyNoise, noiseParameters, withoutDose, withoutFluence
+from webct.components.sim.ResultCache import digest, results
+from webct.components.sim.RWLock import RWLock
+from webct.components.sim.clients.ScratchPool import scratchArray, useScratch
+from webct.components.sim.clients.SimClient import SimCancelledError, SimClient, SimProgress, SimThreadError, SimTimeoutError
+from webct.components.sim.SimManager import configureClients, getClient, getWorkers, releaseClients, replaceClient, shardProjections
+
+# Single projection previews are simulated with a compressed spectrum of at
+# least this many energy bins, more are used if the transmission error would
+# exceed `preview_tolerance`. Scans and downloads use the full spectrum.
+preview_bins = 16
+preview_tolerance = 0.01
+
+# Progressive previews start with a projection binned by this factor, using a
+# spectrum of `coarse_bins` energy bins, before refining to full resolution.
+coarse_binning = 4
+coarse_bins = 8
+
+# Total size of results held in memory by all sessions, beyond which the least
+# recently used sessions are evicted. Evicted results are reloaded from the
+# result cache, or simulated again [bytes]
+memory_budget = 16 * 1024 * 1024 * 1024
+
+# Sessions idle for this long have their simulator processes stopped, and
+# results evicted from memory. They restart on next use [s]
+process_idle_timeout = 15 * 60
+
+# Sessions idle for this long are discarded entirely [s]
+session_timeout = 24 * 60 * 60
+
+# Interval between checks for idle sessions [s]
+reap_interval = 60
 
 class SimSession:
 	"""
@@ -33,130 +66,365 @@ class SimSession:
 	_beam_spectra: Spectra
 	_unfiltered_beam_spectra: Spectra
 	_simClient: SimClient
+	_workers: List[SimClient]
 	_samples: SampleSettings
 	_samples_rendered: RenderedSampleSettings
 	_capture_param: CaptureParameters
-	_counter: int = 1
-
-	# Save a flag if parameters have changed since last projection creation
-	_dirty: List[bool] = [False, False, False]
+	# Which cached results are still valid for the current parameters. Results
+	# are only marked fresh if no parameter they depend on changed while they
+	# were computed.
+	_artifacts: ArtifactGraph
 	_projections: np.ndarray
 	_projection: np.ndarray
+	_full_projection: np.ndarray
 	_reconstruction: np.ndarray
 	_recon_param: ReconParameters
-	_scene: Optional[np.ndarray]
+	_scene: Optional[np.ndarray] = None
+	_layout: Optional[np.ndarray] = None
+	_flatfield: Optional[np.ndarray] = None
+	_darkfield: Optional[np.ndarray] = None
 	_dlmanager:DownloadManager
 
 	# since flask runs python code concurrently, we need to ensure the simclient
 	# class is not used by multiple threads at once; or we have concurrency
 	# issues when talking to the simulator.
-	_lock: Semaphore
+	_client_lock: Lock
+
+	# Each cached result has its own lock, held while it is computed. Requests
+	# for the same result wait for it, while requests for others (such as a
+	# preview during a reconstruction) go ahead. Always taken before the
+	# parameter and client locks.
+	_artifact_locks: Dict[str, Lock]
+
+	# Parameters are guarded separately, so they can be read or changed while
+	# the simulator is busy. Changes are sent to the simulator when next used.
+	_param_lock: RWLock
+	_synced: Dict[str, Any]
+	# Parameters last sent to the helper workers, which are only used for full scans
+	_worker_synced: Dict[str, Any]
+
+	# Noisy images, alongside the noise and the version of the artifact they came from
+	_noised: Dict[str, Tuple[NoiseParameters, Tuple[int, ...], np.ndarray]]
 
 	def __init__(self, sid: int) -> None:
 		log.info(f"Initializing Simulation Session [{sid}]")
-		self._lock = Semaphore(1)
+		self._client_lock = Lock()
+		self._artifact_locks = {name: Lock() for name in ("projection", "full_projection", "scene", "layout", "projections", "reconstruction", "flatfield")}
+		self._param_lock = RWLock()
+		self._artifacts = ArtifactGraph()
+		self._synced = {}
+		self._worker_synced = {}
+		self._noised = {}
 		self._sid = sid
-		self._simClient = getClient(session, sid)
+		self.last_used = monotonic()
+		self._simClient = getClient(sid)
+		self._workers = getWorkers(sid)
 		self.download = DownloadManager(self)
 		self.init_default_parameters()
 
+	@property
+	def _clients(self) -> List[SimClient]:
+		"""The session's simulator client, followed by any helper workers."""
+		if self._simClient is None:
+			return []
+		return [self._simClient, *self._workers]
+
+	def releaseClients(self) -> bool:
+		"""Stop the session's simulator processes, which are restarted on next
+		use. Returns False, doing nothing, if the simulator is busy."""
+		if not self._client_lock.acquire(blocking=False):
+			return False
+		try:
+			if self._simClient is not None:
+				log.info(f"[{self._sid}] Releasing simulator processes")
+				releaseClients(self._sid)
+				self._simClient = None
+				self._workers = []
+				self._synced = {}
+				self._worker_synced = {}
+		finally:
+			self._client_lock.release()
+		return True
+
+	def memoryUsage(self) -> int:
+		"""Bytes of results held in memory. Memory-mapped results are not counted."""
+		arrays = {}
+		for value in (
+			getattr(self, "_projection", None), getattr(self, "_full_projection", None),
+			getattr(self, "_projections", None), getattr(self, "_reconstruction", None),
+			self._darkfield, self._flatfield, self._scene, self._layout,
+			*(noisy for _, _, noisy in self._noised.values()),
+		):
+			if isinstance(value, np.ndarray) and not isinstance(value, np.memmap):
+				arrays[id(value)] = value.nbytes
+		return sum(arrays.values())
+
+	def evict(self) -> bool:
+		"""Drop results held in memory, and stop the simulator processes.
+		Returns False, doing nothing, if any result is being computed."""
+		held = []
+		try:
+			for artifact in self._artifact_locks.values():
+				if not artifact.acquire(blocking=False):
+					return False
+				held.append(artifact)
+			if not self.releaseClients():
+				return False
+
+			log.info(f"[{self._sid}] Evicting {self.memoryUsage() / 1024 / 1024:.1f} MiB of results")
+			with self._param_lock.write():
+				for name in ("_projection", "_full_projection", "_projections", "_reconstruction"):
+					if name in self.__dict__:
+						delattr(self, name)
+				self._noised = {}
+				self._flatfield = None
+				self._darkfield = None
+				self._scene = None
+				self._layout = None
+				self._artifacts.reset()
+			return True
+		finally:
+			for artifact in held:
+				artifact.release()
+
+	def _replaceClients(self, replay: bool = True) -> None:
+		"""Forcefully kill simulator processes after a thread error, and swap in
+		standby processes. Must be called while holding the client lock.
+
+		Args:
+			replay (bool, optional): Send the last synced parameters to the
+				replacements straight away. Otherwise, all parameters are sent on
+				next use. Defaults to True.
+		"""
+		log.error("Replacing Simulator Children with standby processes...")
+		self._simClient = replaceClient(self._simClient, self._sid)
+		self._workers = [replaceClient(worker, self._sid) for worker in self._workers]
+
+		state, self._synced = self._synced, {}
+		worker_state, self._worker_synced = self._worker_synced, {}
+		configs = []
+		if state:
+			configs.append((self._simClient, state))
+		if worker_state:
+			configs.extend((worker, worker_state) for worker in self._workers)
+		if not replay or not configs:
+			return
+
+		log.info(f"[{self._sid}] Replaying {', '.join((state or worker_state).keys())} to replacement simulators")
+		try:
+			configureClients(configs)
+		except SimThreadError:
+			log.exception(f"[{self._sid}] Failed to replay parameters, they will be sent on next use")
+			self._replaceClients(replay=False)
+			return
+		self._synced = state
+		self._worker_synced = worker_state
+
 	def init_default_parameters(self) -> None:
 		# Instantiate default values
-		self.beam = LabBeam(method="lab", projection=PROJECTION.POINT,
-			filters=(Filter(Element.Cu,2),),
-			voltage=70,
-			enableNoise=True,
-			exposure=1,
-			intensity=120,
-			spotSize=0,
-			anodeAngle=12,
-			generator=BEAM_GENERATOR.SPEKPY,
-			material=Element.W
-		)
-		self.detector = DetectorParameters(
-			pane_height=300,
-			pane_width=250,
-			pixel_size=0.5,
-			lsf=DEFAULT_LSF,
-			enableLSF=True,
-			scintillator=Scintillator(SCINTILLATOR_MATERIAL.GADOX, 136.55 / 1000),
-			binning = 1,
-			)
-		self.samples = SampleSettings(
-			scaling = 1.0,
-			samples = (
-				Sample("Dragon Model", "welsh-dragon-small.stl", "mm", "element/aluminium"),
+		self.configure(
+			beam=LabBeam(method="lab", projection=PROJECTION.POINT,
+				filters=(Filter(Element.Cu,2),),
+				voltage=70,
+				enableNoise=True,
+				exposure=1,
+				intensity=120,
+				spotSize=0,
+				anodeAngle=12,
+				generator=BEAM_GENERATOR.SPEKPY,
+				material=Element.W
+			),
+			detector=DetectorParameters(
+				pane_height=300,
+				pane_width=250,
+				pixel_size=0.5,
+				lsf=DEFAULT_LSF,
+				enableLSF=True,
+				scintillator=Scintillator(SCINTILLATOR_MATERIAL.GADOX, 136.55 / 1000),
+				binning = 1,
 			),
+			samples=SampleSettings(
+				scaling = 1.0,
+				samples = (
+					Sample("Dragon Model", "welsh-dragon-small.stl", "mm", "element/aluminium"),
+				),
+			),
+			capture=CaptureParameters(360, 360, (0, 100, 0), (0, -400, 0), (0, 0, 90), False),
+			recon=FDKParam(filter="ram-lak"),
 		)
-		self.capture = CaptureParameters(360, 360, (0, 100, 0), (0, -400, 0), (0, 0, 90), False)
-		self.recon = FDKParam(filter="ram-lak")
+
+	def configure(self, beam: Optional[BeamParameters] = None, detector: Optional[DetectorParameters] = None,
+			samples: Optional[SampleSettings] = None, capture: Optional[CaptureParameters] = None,
+			recon: Optional[ReconParameters] = None) -> None:
+		"""Set any subset of parameters at once.
+
+		Changes are recorded, and only sent to the simulator once an image is
+		requested. Repeated changes collapse into the latest value.
+		"""
+		# Generating spectra and rendering samples may raise a value error, let
+		# this propagate upwards before any parameters are set. Spectra are
+		# cached, so this is done outside of the lock.
+		spectra = generateSpectra(beam) if beam is not None else None
+		samples_rendered = samples.render() if samples is not None else None
+
+		with self._param_lock.write():
+			# Skip unchanged parameters
+			if beam is not None and hasattr(self, "_beam_param") and beam == self._beam_param:
+				beam = None
+			if detector is not None and hasattr(self, "_detector_param") and detector == self._detector_param:
+				detector = None
+			if samples is not None and hasattr(self, "_samples") and samples == self._samples:
+				samples = None
+			if capture is not None and hasattr(self, "_capture_param") and capture == self._capture_param:
+				capture = None
+			if recon is not None and hasattr(self, "_recon_param") and recon == self._recon_param:
+				recon = None
+
+			if recon is not None:
+				log.info(f"[{self._sid}] Updating Reconstruction")
+				self._artifacts.invalidate(["recon"])
+				self._recon_param = recon
+
+			if beam is None and detector is None and samples is None and capture is None:
+				return
+
+			changed = set()
+			if beam is not None:
+				# Noise is applied after simulating, so if only the dose has changed
+				# the noise-free images are still valid.
+				changed.add("dose")
+				if not hasattr(self, "_beam_param") or withoutDose(beam) != withoutDose(self._beam_param):
+					changed.add("beam")
+			for name, value in (("detector", detector), ("samples", samples), ("capture", capture)):
+				if value is not None:
+					changed.add(name)
+
+			log.info(f"[{self._sid}] Updating {', '.join(sorted(changed))}")
+			self._artifacts.invalidate(changed)
+			# Drop noisy images as soon as they are stale, rather than holding
+			# them alongside their replacements.
+			stale = self._artifacts.affected(changed)
+			self._noised = {
+				name: entry for name, entry in self._noised.items()
+				if name not in stale and "dose" not in changed
+			}
+
+			if beam is not None:
+				self._beam_param = beam
+				self._beam_spectra, self._unfiltered_beam_spectra = spectra
+			if detector is not None:
+				self._detector_param = detector
+			if samples is not None:
+				self._samples = samples
+				self._samples_rendered = samples_rendered
+			if capture is not None:
+				self._capture_param = capture
+
+			if "projections" in self._artifacts.affected(changed):
+				self._cancel()
+
+	def _cancel(self) -> None:
+		"""Stop any scan in flight, as its parameters are stale. Must be called
+		while holding the parameter write lock."""
+		for client in self._clients:
+			client.cancel()
+
+	def _state(self, preview: bool = False) -> Dict[str, Any]:
+		"""Parameters the simulator should hold. Must be called while holding the parameter lock.
+
+		Args:
+			preview (bool, optional): Use a compressed spectrum, for quicker
+				interactive previews. Defaults to False.
+		"""
+		spectra = self._beam_spectra
+		if preview:
+			spectra, _ = compressSpectra(spectra, preview_bins, preview_tolerance)
+		return {
+			"beam": Beam(self._beam_param, spectra),
+			"detector": self._detector_param,
+			"samples": self._samples_rendered,
+			"capture": self._capture_param,
+		}
+
+	def _resultKey(self, kind: str, state: Dict[str, Any], *extra: Any) -> str:
+		"""Key of a noise-free result in the persistent result cache. The dose
+		does not change noise-free images, so is left out of both the beam
+		parameters and the spectrum."""
+		beam: Beam = state["beam"]
+		beam = Beam(withoutDose(beam.params), withoutFluence(beam.spectra))
+		return digest(kind, beam, state["detector"], state["samples"], state["capture"], *extra)
+
+	def _sync(self, state: Dict[str, Any], workers: bool = False) -> None:
+		"""Send parameters that differ from the last sync to the simulator, in a
+		single request. Must be called while holding the client lock.
+
+		Args:
+			workers (bool, optional): Also sync the helper workers, which only
+				full scans use. Defaults to False.
+		"""
+		self.last_used = monotonic()
+		if self._simClient is None:
+			# Processes are released while a session is idle.
+			log.info(f"[{self._sid}] Starting simulator processes")
+			self._simClient = getClient(self._sid)
+			self._workers = getWorkers(self._sid)
+
+		configs = []
+		changes = {key: value for key, value in state.items() if self._synced.get(key) != value}
+		if changes:
+			configs.append((self._simClient, changes))
+		worker_changes = {}
+		if workers and self._workers:
+			worker_changes = {key: value for key, value in state.items() if self._worker_synced.get(key) != value}
+			if worker_changes:
+				configs.extend((worker, worker_changes) for worker in self._workers)
+		if not configs:
+			return
+
+		log.info(f"[{self._sid}] Sending {', '.join((changes or worker_changes).keys())} to {len(configs)} simulator(s)")
+		try:
+			# Children apply parameters in parallel.
+			configureClients(configs)
+		except SimThreadError as e:
+			log.error("Thread Error while setting configuration! Forcefully killing Client...")
+			self._replaceClients()
+			raise e
+		self._synced.update(changes)
+		self._worker_synced.update(worker_changes)
 
 	@property
 	def beam(self) -> BeamParameters:
-		with self._lock:
+		with self._param_lock.read():
 			return self._beam_param
 
 	@beam.setter
 	def beam(self, value: BeamParameters) -> None:
-		with self._lock:
-			if hasattr(self, "_beam_param") and value == self._beam_param:
-				return
-			log.info(f"[{self._sid}] Updating beam")
-			self._dirty = [True, True, True]
-			self._counter += 1
-			self._beam_param = value
-			self._beam_spectra, self._unfiltered_beam_spectra = generateSpectra(value)
-			try:
-				self._simClient.setBeam(value, self._beam_spectra)
-			except SimThreadError as e:
-				log.error("Thread Error while setting beam parameters! Forcefully killing Client...")
-				self._simClient.kill()
-				log.error("Replacing Simulator Child with a new one...")
-				self._simClient = SimClient(self._sid)
-				raise e
+		self.configure(beam=value)
 
 	@property
 	def spectra(self) -> Spectra:
-		with self._lock:
+		with self._param_lock.read():
 			return self._beam_spectra
 
 	@property
 	def unfilteredSpectra(self) -> Spectra:
-		with self._lock:
+		with self._param_lock.read():
 			return self._unfiltered_beam_spectra
 
 	@property
 	def samples(self) -> SampleSettings:
-		with self._lock:
+		with self._param_lock.read():
 			return self._samples
 
 	@samples.setter
 	def samples(self, value:SampleSettings) -> None:
-		with self._lock:
-			if hasattr(self, "_samples") and value == self._samples:
-				return
-			log.info(f"[{self._sid}] Updating Samples")
-			self._dirty = [True, True, True]
-			self._counter += 1
-
-			# rendering samples may call a value error, let this propagate upwards before we set samples.
-			self._samples_rendered = value.render()
-			self._samples = value
-
-			# We only send rendered samples to the simulation client.
-			# Only reason we store both unrendered and rendered, are for `self.update()`
-			try:
-				self._simClient.setSamples(self._samples_rendered)
-			except SimThreadError as e:
-				log.error("Thread Error while setting samples! Forcefully killing Client...")
-				self._simClient.kill()
-				log.error("Replacing Simulator Child with a new one...")
-				self._simClient = SimClient(self._sid)
-				raise e
+		# We only send rendered samples to the simulation client.
+		# Only reason we store both unrendered and rendered, are for `self.update()`
+		self.configure(samples=value)
 
 	def update(self) -> None:
 		"""Re-render sample properties to propagate material changes to the simulator."""
-		with self._lock:
+		with self._param_lock.write():
 			log.info(f"[{self._sid}] Rendering sample properties")
 			# rendering samples may call a value error, let this propagate upwards
 			new_samples = self._samples.render()
@@ -165,43 +433,23 @@ class SimSession:
 				# Don't update the client if there is nothing to change.
 				return
 
-			# sample materials have changed, update client.
-			self._counter += 1
+			# sample materials have changed, the client is updated on next use.
+			self._artifacts.invalidate(["samples"])
 			self._samples_rendered = new_samples
-			try:
-				self._simClient.setSamples(self._samples_rendered)
-			except SimThreadError as e:
-				log.error("Thread Error while re-rendering samples! Forcefully killing Client...")
-				self._simClient.kill()
-				log.error("Replacing Simulator Child with a new one...")
-				self._simClient = SimClient(self._sid)
-				raise e
+			self._cancel()
 
 	@property
 	def detector(self) -> DetectorParameters:
-		with self._lock:
+		with self._param_lock.read():
 			return self._detector_param
 
 	@detector.setter
 	def detector(self, value: DetectorParameters) -> None:
-		with self._lock:
-			if hasattr(self, "_detector_param") and value == self._detector_param:
-				return
-			log.info(f"[{self._sid}] Updating Detector")
-			self._dirty = [True, True, True]
-			self._counter += 1
-			self._detector_param = value
-			try:
-				self._simClient.setDetector(value)
-			except SimThreadError as e:
-				log.error("Thread Error while setting detector parameters! Forcefully killing Client...")
-				self._simClient.kill()
-				log.error("Replacing Simulator Child with a new one...")
-				self._simClient = SimClient(self._sid)
-				raise e
+		self.configure(detector=value)
 
-	def transmission_histogram(self) -> Tuple[List[float], List[float]]:
-		projection = self.projection()
+	def transmission_histogram(self, projection: Optional[np.ndarray] = None) -> Tuple[List[float], List[float]]:
+		if projection is None:
+			projection = self.projection()
 
 		hist, bins = np.histogram(projection, 100, (0, 1))
 
@@ -215,143 +463,331 @@ class SimSession:
 
 		return hist.astype(float).tolist(), bins.astype(float).tolist()
 
-	def projection(self) -> np.ndarray:
-		with self._lock:
-			if self._dirty[0] and not self._dirty[1]:
-				# Just nick first proj from allprojections
-				return self._projections[0]
-			if not self._dirty[0] and hasattr(self, "_projection"):
-				return self._projection
-			self._counter += 1
-			if self._dirty[0]:
-				self._projection = {}
-				self._dirty[0] = False
-				self._scene = None
-
+	def _withNoise(self, name: str, version: Tuple[int, ...], clean: np.ndarray) -> np.ndarray:
+		"""Apply noise to noise-free images, if enabled. The result is cached
+		until the images or the dose change.
+
+		Args:
+			name (str): Artifact the images are of.
+			version (Tuple[int, ...]): Version of the artifact, taken before the
+				images were obtained, so newer images are never cached as older.
+			clean (np.ndarray): Noise-free images.
+		"""
+		with self._param_lock.read():
+			noise = noiseParameters(self._beam_param, self._detector_param, self._capture_param)
+		if noise is None:
+			return clean
+
+		# Keyed by version rather than identity, as the same images may be
+		# returned as a new view, such as the first of all projections.
+		cached = self._noised.get(name)
+		if cached is not None and cached[:2] == (noise, version):
+			return cached[2]
+
+		log.info(f"[{self._sid}] Applying noise to {name}")
+		# Large scans are noised into the scratch folder, rather than RAM.
+		out = scratchArray(clean.shape, np.float32) if useScratch(clean.nbytes) else None
+		noisy = applyNoise(clean, noise, out=out)
+		with self._param_lock.write():
+			if self._artifacts.version(name) == version:
+				self._noised[name] = (noise, version, noisy)
+		return noisy
+
+	def _version(self, name: str) -> Tuple[int, ...]:
+		with self._param_lock.read():
+			return self._artifacts.version(name)
+
+	def projection(self, preview: bool = True) -> np.ndarray:
+		"""Simulate a single projection, with noise if enabled.
+
+		Args:
+			preview (bool, optional): Use the compressed preview spectrum, which
+				is quicker to simulate. Downloads should use the full spectrum.
+				Defaults to True.
+		"""
+		name = "projection" if preview else "full_projection"
+		return self._withNoise(name, self._version(name), self._cleanProjection(preview))
+
+	def coarseProjection(self) -> Tuple[np.ndarray, bool]:
+		"""Quickly simulate a low resolution projection, for progressive previews.
+
+		The detector is temporarily binned and the spectrum compressed. If the
+		full resolution projection is already up to date, it is returned instead.
+
+		Returns:
+			Tuple[np.ndarray, bool]: The projection, and whether it is full resolution.
+		"""
+		with self._param_lock.read():
+			fresh = self._artifacts.fresh("projection") or self._artifacts.fresh("projections")
+			detector = self._detector_param
+			# Keep at least a few pixels along each side of the detector.
+			binning = max(1, min(coarse_binning, min(detector.binned_shape) // 16))
+			if not fresh and binning > 1:
+				detector = replace(detector, binning=detector.binning * binning)
+				state = self._state()
+				state["beam"] = Beam(self._beam_param, compressSpectra(self._beam_spectra, coarse_bins)[0])
+				state["detector"] = detector
+				noise = noiseParameters(self._beam_param, detector, self._capture_param)
+
+		if fresh or binning == 1:
+			return self.projection(), True
+
+		with self._client_lock:
+			log.info(f"[{self._sid}] Simulating coarse projection, binned by {binning}")
+			self._sync(state)
 			try:
-				self._projection = self._simClient.getProjection()
+				projection = self._simClient.getProjection()
 			except SimThreadError as e:
-				log.error("Thread Error while simulating one projection! Forcefully killing Client...")
-				self._simClient.kill()
-				log.error("Replacing Simulator Child with a new one...")
-				self._simClient = SimClient(self._sid)
+				log.error("Thread Error while simulating a coarse projection! Forcefully killing Client...")
+				self._replaceClients()
 				raise e
-			return self._projection
-
-	def scene(self) -> np.ndarray:
-		with self._lock:
-			if not self._dirty[0] and hasattr(self, "_scene") and self._scene is not None:
+		return (projection if noise is None else applyNoise(projection, noise)), False
+
+	def _cleanProjection(self, preview: bool = True) -> np.ndarray:
+		name = "projection" if preview else "full_projection"
+		with self._artifact_locks[name]:
+			with self._param_lock.read():
+				if self._artifacts.fresh(name):
+					return getattr(self, f"_{name}")
+				if self._artifacts.fresh("projections"):
+					# Just nick first proj from allprojections
+					return self._projections[0]
+				version = self._artifacts.version(name)
+				state = self._state(preview=preview)
+
+			key = self._resultKey("projection", state)
+			projection = results.get(key)
+			if projection is None:
+				with self._client_lock:
+					self._sync(state)
+					try:
+						projection = self._simClient.getProjection()
+					except SimThreadError as e:
+						log.error("Thread Error while simulating one projection! Forcefully killing Client...")
+						self._replaceClients()
+						raise e
+				results.put(key, projection)
+
+			with self._param_lock.write():
+				setattr(self, f"_{name}", projection)
+				# Parameters may have changed while simulating.
+				self._artifacts.store(name, version)
+			return projection
+
+	def scene(self, render: bool = True) -> Optional[np.ndarray]:
+		"""Render the scene, or return the cached render.
+
+		Args:
+			render (bool, optional): Render the scene if it is out of date. If
+				False, the last render is returned as is, which may be out of date
+				or None. Defaults to True.
+		"""
+		if not render:
+			with self._param_lock.read():
 				return self._scene
-			self._counter += 1
 
-			try:
-				self._scene = self._simClient.getScene()
-			except SimThreadError as e:
-				log.error("Thread Error while rendering scene! Forcefully killing Client...")
-				self._simClient.kill()
-				log.error("Replacing Simulator Child with a new one...")
-				self._simClient = SimClient(self._sid)
-				raise e
-			return self._scene
-
-	def allProjections(self) -> np.ndarray:
-		with self._lock:
-			if not self._dirty[1] and hasattr(self, "_projections"):
-				return self._projections
-			self._counter += 1
-			if self._dirty[1]:
-				self._projections = {}
-				self._dirty[1] = False
-			try:
-				self._projections = self._simClient.getAllProjections()
-			except SimThreadError as e:
-				if isinstance(e, SimTimeoutError):
-					log.error("Waited too long (>1s per projection) to render all projections. Unsure if simulator crashed since it's not responding. Forcefully killing Client...")
+		with self._artifact_locks["scene"]:
+			with self._param_lock.read():
+				if self._artifacts.fresh("scene"):
+					return self._scene
+				version = self._artifacts.version("scene")
+				state = self._state(preview=True)
+
+			with self._client_lock:
+				self._sync(state)
+				try:
+					scene = self._simClient.getScene()
+				except SimThreadError as e:
+					log.error("Thread Error while rendering scene! Forcefully killing Client...")
+					self._replaceClients()
+					raise e
+
+			with self._param_lock.write():
+				self._scene = scene
+				self._artifacts.store("scene", version)
+			return scene
+
+	def allProjections(self, progress: Optional[Callable[[np.ndarray, SimProgress], None]] = None) -> np.ndarray:
+		"""Simulate all projections, or return the cached stack, with noise
+		if enabled.
+
+		If parameters change while simulating, the scan is cancelled and
+		restarted with the new parameters.
+
+		Args:
+			progress (Callable[[np.ndarray, SimProgress], None], optional): Called
+				as each block of noise-free projections lands, so consumers can
+				start on completed projections before the scan finishes.
+		"""
+		return self._withNoise("projections", self._version("projections"), self._cleanAllProjections(progress))
+
+	def _cleanAllProjections(self, progress: Optional[Callable[[np.ndarray, SimProgress], None]] = None) -> np.ndarray:
+		with self._artifact_locks["projections"]:
+			while True:
+				with self._param_lock.write():
+					if self._artifacts.fresh("projections"):
+						return self._projections
+					# Drop the previous scan and its noisy copy, so its shared
+					# memory is released once any remaining readers are done.
+					self._projections = {}
+					self._noised.pop("projections", None)
+					version = self._artifacts.version("projections")
+					state = self._state()
+
+					# Any parameter change after this point cancels the scan.
+					for client in self._clients:
+						client.clearCancel()
+
+				key = self._resultKey("projections", state)
+				projections = results.get(key)
+				if projections is not None:
+					if progress is not None:
+						progress(projections, SimProgress(0, len(projections), len(projections), len(projections)))
 				else:
-					log.error("Thread Error while simulating all projections! Forcefully killing Client...")
-				self._simClient.kill()
-				log.error("Replacing Simulator Child with a new one...")
-				self._simClient = SimClient(self._sid)
-				raise e
-			return self._projections
-
-	def layout(self) -> np.ndarray:
-		geo = get_geometry(self.capture, self.beam, self.detector)
-		# Obtain canvas from figure
-		fig: Figure = show_geometry(geo, figsize=(8, 6)).figure
-
-		width, height = fig.get_size_inches() * fig.get_dpi()
-		width = int(width)
-		height = int(height)
-
-		# render matplotlib image to canvas
-		canvas = FigureCanvasAgg(fig)
-		canvas.draw()
-
-		return np.frombuffer(canvas.tostring_rgb(), dtype="uint8").reshape(height, width, 3)
+					with self._client_lock:
+						self._sync(state, workers=True)
+						try:
+							if self._workers:
+								projections = shardProjections(self._clients, progress)
+							else:
+								projections = self._simClient.getAllProjections(progress)
+						except SimCancelledError:
+							log.info(f"[{self._sid}] Parameters changed while simulating, restarting scan")
+							continue
+						except SimThreadError as e:
+							if isinstance(e, SimTimeoutError):
+								log.error("Waited too long for a block of projections. Unsure if simulator crashed since it's not responding. Forcefully killing Client...")
+							else:
+								log.error("Thread Error while simulating all projections! Forcefully killing Client...")
+							self._replaceClients()
+							raise e
+					results.put(key, projections)
+
+				with self._param_lock.write():
+					self._projections = projections
+					self._artifacts.store("projections", version)
+				return projections
+
+	def layout(self, render: bool = True) -> np.ndarray:
+		"""Diagram of the scan geometry, or the cached diagram.
+
+		Args:
+			render (bool, optional): Draw the diagram if it is out of date. If
+				False, the last diagram is returned as is, which may be out of
+				date, and is only drawn if there is none. Defaults to True.
+		"""
+		with self._artifact_locks["layout"]:
+			with self._param_lock.read():
+				if self._artifacts.fresh("layout") or (not render and self._layout is not None):
+					return self._layout
+				version = self._artifacts.version("layout")
+				geo = get_geometry(self._capture_param, self._beam_param, self._detector_param)
+
+			# Obtain canvas from figure
+			fig: Figure = show_geometry(geo, figsize=(8, 6)).figure
+
+			width, height = fig.get_size_inches() * fig.get_dpi()
+			width = int(width)
+			height = int(height)
+
+			# render matplotlib image to canvas
+			canvas = FigureCanvasAgg(fig)
+			canvas.draw()
+
+			layout = np.frombuffer(canvas.tostring_rgb(), dtype="uint8").reshape(height, width, 3)
+			with self._param_lock.write():
+				self._layout = layout
+				self._artifacts.store("layout", version)
+			return layout
 
 	@property
 	def recon(self) -> ReconParameters:
-		return self._recon_param
+		with self._param_lock.read():
+			return self._recon_param
 
 	@recon.setter
 	def recon(self, value: ReconParameters) -> None:
-		with self._lock:
-			if hasattr(self, "_recon_param") and value == self._recon_param:
-				return
-			log.info(f"[{self._sid}] Updating Reconstruction")
-			self._dirty[2] = True
-			self._counter += 1
-			self._recon_param = value
-
-	def getReconstruction(self) -> np.ndarray:
-		with self._lock:
-			if not self._dirty[2] and hasattr(self, "_reconstruction"):
-				return self._reconstruction
-			self._counter += 1
-			if self._dirty[2]:
-				self._reconstruction = {}
-				self._dirty[2] = False
-
-			# Get projections
-			# We have the lock, so disregard locking
-			self._lock.release()
-			projections = self.allProjections()
-			self._lock.acquire()
-
-			log.info(f"[{self._sid}] Reconstructing")
-			self._reconstruction = reconstruct(projections, self._capture_param, self._beam_param, self._detector_param, self._recon_param)
-			return self._reconstruction
+		self.configure(recon=value)
+
+	def getReconstruction(self, progress: Optional[Callable[[np.ndarray, SimProgress], None]] = None) -> np.ndarray:
+		with self._artifact_locks["reconstruction"]:
+			with self._param_lock.read():
+				if self._artifacts.fresh("reconstruction"):
+					return self._reconstruction
+				version = self._artifacts.version("reconstruction")
+				params = (self._capture_param, self._beam_param, self._detector_param, self._recon_param)
+				# Reconstructions are of noisy projections, so depend on the dose.
+				state = self._state()
+				key = digest("reconstruction", state["beam"], state["detector"], state["samples"], state["capture"], self._recon_param)
+
+			reconstruction = results.get(key)
+			if reconstruction is None:
+				# Projections have their own lock, and the simulator is free for
+				# other requests while reconstructing.
+				projections = self.allProjections(progress)
+
+				log.info(f"[{self._sid}] Reconstructing")
+				reconstruction = reconstruct(projections, *params)
+				if useScratch(reconstruction.nbytes):
+					# CIL reconstructs in memory, but the session need not keep it there.
+					stored = scratchArray(reconstruction.shape, reconstruction.dtype)
+					np.copyto(stored, reconstruction)
+					reconstruction = stored
+
+				with self._param_lock.read():
+					# Projections may have been simulated with newer parameters
+					# than the key was taken from.
+					current = self._artifacts.version("reconstruction") == version
+				if current:
+					results.put(key, reconstruction)
+
+			with self._param_lock.write():
+				self._reconstruction = reconstruction
+				self._artifacts.store("reconstruction", version)
+			return reconstruction
 
 	@property
 	def capture(self) -> CaptureParameters:
-		with self._lock:
+		with self._param_lock.read():
 			return self._capture_param
 
 	@capture.setter
 	def capture(self, value: CaptureParameters) -> None:
-		with self._lock:
-			if hasattr(self, "_capture_param") and value == self._capture_param:
-				return
-			log.info(f"[{self._sid}] Updating Capture")
-			self._dirty = [True, True, True]
-			self._counter += 1
-			self._capture_param = value
-			try:
-				self._simClient.setCapture(value)
-			except SimThreadError as e:
-				log.error("Thread Error while setting capture parameters! Forcefully killing Client...")
-				self._simClient.kill()
-				log.error("Replacing Simulator Child with a new one...")
-				self._simClient = SimClient(self._sid)
-				raise e
+		self.configure(capture=value)
 
 	@property
 	def flatfield(self) -> np.ndarray:
-		return self._flatfield
+		"""Image of the beam without samples, which depends only on the beam,
+		detector, and capture parameters."""
+		with self._artifact_locks["flatfield"]:
+			with self._param_lock.read():
+				if self._artifacts.fresh("flatfield"):
+					return self._flatfield
+				version = self._artifacts.version("flatfield")
+				state = self._state()
+
+			with self._client_lock:
+				self._sync(state)
+				try:
+					flatfield = self._simClient.getFlatField()
+				except SimThreadError as e:
+					log.error("Thread Error while simulating flat field! Forcefully killing Client...")
+					self._replaceClients()
+					raise e
+			flatfield.flags.writeable = False
+			with self._param_lock.write():
+				self._flatfield = flatfield
+				self._artifacts.store("flatfield", version)
+			return flatfield
 
 	@property
 	def darkfield(self) -> np.ndarray:
+		"""Image with the beam off. The simulator has no dark current, so this
+		is always zero."""
+		flatfield = self.flatfield
+		if self._darkfield is None or self._darkfield.shape != flatfield.shape:
+			self._darkfield = np.zeros_like(flatfield)
+			self._darkfield.flags.writeable = False
 		return self._darkfield
 
 
@@ -360,24 +796,72 @@ rng = Random()
 lock = Semaphore()
 
 
+_reaper: Optional[Thread] = None
+
+
 def Sim(sesh) -> SimSession:
+	global _reaper
 	with lock:
 		session.update()
 
 		if sesh.get("sid") is None:
-			# Only one session is currently supported
-			sid = 1
-
-			# sid = rng.randint(0, 10000)
-			# while sid in stored_sessions:
-			# 	sid = rng.randint(0, 10000)
+			# Each browser is given its own session.
+			sid = rng.randint(0, 2**31)
+			while sid in stored_sessions:
+				sid = rng.randint(0, 2**31)
 			sesh["sid"] = sid
 
 		sid = int(sesh["sid"])
 
-		if sid in stored_sessions:
-			return stored_sessions[sid]
-		else:
+		if sid not in stored_sessions:
 			log.info(f"Creating new Simulator Session [{sid}]")
 			stored_sessions[sid] = SimSession(sid)
-			return stored_sessions[sid]
+		sim = stored_sessions[sid]
+		sim.last_used = monotonic()
+
+		if _reaper is None:
+			_reaper = Thread(target=_reapSessions, name="WCT-Reaper", daemon=True)
+			_reaper.start()
+
+	enforceBudget(sim)
+	return sim
+
+
+def enforceBudget(current: Optional[SimSession] = None) -> None:
+	"""Evict the least recently used sessions' results while the total held
+	in memory exceeds `memory_budget`. The current session is never evicted."""
+	with lock:
+		sessions = sorted(stored_sessions.values(), key=lambda sim: sim.last_used)
+	usage = {sim._sid: sim.memoryUsage() for sim in sessions}
+	total = sum(usage.values())
+
+	for sim in sessions:
+		if total <= memory_budget:
+			return
+		if sim is current or usage[sim._sid] == 0:
+			continue
+		if sim.evict():
+			total -= usage[sim._sid]
+
+	if total > memory_budget:
+		log.warning(f"Sessions hold {total / 1024 / 1024:.1f} MiB, over the budget of {memory_budget / 1024 / 1024:.1f} MiB")
+
+
+def _reapSessions() -> None:
+	"""Release idle sessions' processes and results, and discard expired sessions."""
+	while True:
+		sleep(reap_interval)
+		now = monotonic()
+		with lock:
+			sessions = list(stored_sessions.values())
+
+		for sim in sessions:
+			idle = now - sim.last_used
+			if idle > session_timeout and sim.evict():
+				log.info(f"[{sim._sid}] Session idle for {idle:.0f}s, discarding")
+				with lock:
+					if stored_sessions.get(sim._sid) is sim and sim.last_used < now:
+						del stored_sessions[sim._sid]
+			elif idle > process_idle_timeout and sim._simClient is not None:
+				log.info(f"[{sim._sid}] Session idle for {idle:.0f}s, releasing simulator")
+				sim.evict()
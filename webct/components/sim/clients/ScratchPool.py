@@ -0,0 +1,132 @@
+from random import Random
+from threading import Lock
+from typing import Dict, Optional, Tuple
+import os
+import tempfile
+import weakref
+import logging
+log = logging.getLogger("Simulator")
+
+import numpy as np
+
+rng = Random()
+
+# Folder on a scratch volume for memory-mapped scans and reconstructions. When
+# None, all results are kept in shared memory and RAM.
+scratch_folder: Optional[str] = None
+
+# Arrays of at least this size are stored in the scratch folder, if set [bytes]
+memmap_threshold = 1024 * 1024 * 1024
+
+
+def useScratch(nbytes: int) -> bool:
+	"""Whether an array of `nbytes` should be memory mapped from the scratch folder."""
+	return scratch_folder is not None and nbytes >= memmap_threshold
+
+
+def _remove(path: str) -> None:
+	try:
+		os.remove(path)
+	except OSError:
+		# Still mapped elsewhere on some platforms, so left for the OS to clean.
+		log.warning(f"Unable to remove scratch file {path}")
+
+
+def scratchArray(shape: Tuple[int, ...], dtype: type) -> np.memmap:
+	"""Allocate an array backed by a temporary file in the scratch folder.
+
+	The file is removed once the array, and any views of it, are collected.
+	"""
+	os.makedirs(scratch_folder, exist_ok=True)
+	fd, path = tempfile.mkstemp(prefix="WCT_MM-", suffix=".dat", dir=scratch_folder)
+	os.close(fd)
+	array = np.memmap(path, dtype=dtype, mode="w+", shape=shape)
+	weakref.finalize(array, _remove, path)
+	return array
+
+
+def isScratch(name: str) -> bool:
+	"""Whether a result name is the path of a scratch file, rather than a
+	shared memory segment."""
+	return os.path.basename(name).startswith("WCT_MM-") and os.path.dirname(name) != ""
+
+
+def openScratch(path: str, shape: Tuple[int, ...], dtype: type) -> np.memmap:
+	"""Map a file allocated by a `ScratchPool`, used by the child to write results."""
+	return np.memmap(path, dtype=dtype, mode="r+", shape=shape)
+
+
+class ScratchPool:
+	"""A set of memory-mapped files owned by the parent process.
+
+	The file-backed counterpart to `SharedMemoryPool`, for results too large to
+	hold in RAM. Each slot keeps one file, which is reused across requests and
+	only replaced when a larger file is required. Detached files return to
+	their slot once the array using them is collected.
+	"""
+
+	def __init__(self, prefix: str) -> None:
+		self._prefix = f"{prefix}-{rng.randint(0, 0xFFFFFF):x}"
+		self._files: Dict[str, Tuple[str, int]] = {}
+		self._lock = Lock()
+		self._finalizer = weakref.finalize(self, ScratchPool._release, self._files)
+
+	def get(self, slot: str, shape: Tuple[int, ...], dtype: type) -> Tuple[str, np.memmap]:
+		"""Obtain a memory-mapped array for a slot, growing the backing file if needed.
+
+		Returns:
+			Tuple[str, np.memmap]: Path of the file, and an array mapping it.
+		"""
+		nbytes = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+		with self._lock:
+			path, size = self._files.get(slot, (None, 0))
+
+			if path is None or size < nbytes:
+				if path is not None:
+					log.info(f"Growing scratch slot '{slot}' from {size} to {nbytes} bytes")
+					_remove(path)
+				os.makedirs(scratch_folder, exist_ok=True)
+				path = os.path.join(scratch_folder, f"WCT_MM-{self._prefix}-{slot}-{rng.randint(0, 2**31)}.dat")
+				with open(path, "wb") as f:
+					f.truncate(nbytes)
+				self._files[slot] = (path, nbytes)
+
+		return path, np.memmap(path, dtype=dtype, mode="r+", shape=shape)
+
+	def detach(self, slot: str, array: np.memmap) -> None:
+		"""Hand a slot's file over to an array returned by `get`. The file
+		returns to the slot once the array, and any views of it, are collected,
+		unless the slot already holds one as large."""
+		with self._lock:
+			entry = self._files.pop(slot, None)
+		if entry is not None:
+			weakref.finalize(array, ScratchPool._reclaim, weakref.ref(self), slot, entry)
+
+	@staticmethod
+	def _reclaim(pool_ref: "weakref.ref[ScratchPool]", slot: str, entry: Tuple[str, int]) -> None:
+		pool = pool_ref()
+		if pool is None or not pool._finalizer.alive:
+			_remove(entry[0])
+			return
+
+		with pool._lock:
+			current = pool._files.get(slot)
+			if current is None or current[1] < entry[1]:
+				pool._files[slot] = entry
+				entry, current = current, None
+		if entry is not None:
+			_remove(entry[0])
+
+	def close(self) -> None:
+		"""Remove all files held by this pool."""
+		self._finalizer()
+
+	def __reduce__(self):
+		# Files belong to the parent, so the child receives an empty pool.
+		return (ScratchPool, (self._prefix,))
+
+	@staticmethod
+	def _release(files: Dict[str, Tuple[str, int]]) -> None:
+		for path, _ in files.values():
+			_remove(path)
+		files.clear()
@@ -0,0 +1,229 @@
+from multiprocessing import shared_memory
+from random import Random
+from threading import Lock
+from typing import Dict, Optional, Tuple
+import time
+import weakref
+import logging
+log = logging.getLogger("Simulator")
+
+import numpy as np
+
+rng = Random()
+
+
+def segment_slot(name: str) -> str:
+	"""Returns the pool slot a shared memory segment was allocated for.
+
+	Segment names are formatted as `WCT_SM-{prefix}-{pool}-{slot}-{id}`, so the
+	slot is everything before the final separator.
+	"""
+	return name.rsplit("-", 1)[0]
+
+
+def _close_segment(mem: shared_memory.SharedMemory, unlink: bool) -> None:
+	try:
+		mem.close()
+	except BufferError:
+		# An ndarray still wraps the buffer (for example, projections held by a
+		# session). The mapping is released once the last view is collected.
+		pass
+	if unlink:
+		try:
+			mem.unlink()
+		except FileNotFoundError:
+			pass
+
+
+class SharedMemoryPool:
+	"""A set of named shared memory segments owned by the parent process.
+
+	Each slot (such as a single projection or a full scan) keeps one segment,
+	which is reused across requests and only replaced when a larger buffer is
+	required. This avoids paying for a fresh mmap and zero-fill on every
+	simulation request.
+
+	A segment handed out for good with `detach` returns to its slot once the
+	array using it is collected, so it is still reused by later requests.
+	"""
+
+	def __init__(self, prefix: str) -> None:
+		# Multiple clients may share a prefix, so each pool is also given an ID.
+		self._prefix = f"{prefix}-{rng.randint(0, 0xFFFFFF):x}"
+		self._segments: Dict[str, shared_memory.SharedMemory] = {}
+		# Detached segments are returned from whichever thread collects them.
+		self._lock = Lock()
+		# Segments are unlinked when the pool is collected or the interpreter exits.
+		self._finalizer = weakref.finalize(self, SharedMemoryPool._release, self._segments)
+
+	def get(self, slot: str, shape: Tuple[int, ...], dtype: type) -> Tuple[str, np.ndarray]:
+		"""Obtain a shared array for a slot, growing the backing segment if needed.
+
+		Args:
+			slot (str): Name of the slot, such as "projection".
+			shape (Tuple[int, ...]): Shape of the requested array.
+			dtype (type): Data type of the requested array.
+
+		Returns:
+			Tuple[str, np.ndarray]: Name of the shared memory segment, and an array wrapping it.
+		"""
+		nbytes = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+		with self._lock:
+			mem = self._segments.get(slot)
+
+			if mem is None or mem.size < nbytes:
+				if mem is not None:
+					log.info(f"Growing shared memory slot '{slot}' from {mem.size} to {nbytes} bytes")
+					_close_segment(mem, unlink=True)
+				mem = shared_memory.SharedMemory(
+					f"WCT_SM-{self._prefix}-{slot}-{rng.randint(0, 2**31)}", create=True, size=nbytes
+				)
+				self._segments[slot] = mem
+
+		return mem.name, np.ndarray(shape, dtype=dtype, buffer=mem.buf)
+
+	def detach(self, slot: str, array: np.ndarray) -> None:
+		"""Hand a slot's segment over to an array returned by `get`.
+
+		Until the array, and any views of it, are collected, the slot is given
+		a fresh segment, so the array is never overwritten. The segment then
+		returns to the slot, unless the slot already holds one as large.
+		"""
+		with self._lock:
+			mem = self._segments.pop(slot, None)
+		if mem is not None:
+			weakref.finalize(array, SharedMemoryPool._reclaim, weakref.ref(self), slot, mem)
+
+	@staticmethod
+	def _reclaim(pool_ref: "weakref.ref[SharedMemoryPool]", slot: str, mem: shared_memory.SharedMemory) -> None:
+		pool = pool_ref()
+		if pool is None or not pool._finalizer.alive:
+			_close_segment(mem, unlink=True)
+			return
+
+		with pool._lock:
+			current = pool._segments.get(slot)
+			if current is None or current.size < mem.size:
+				pool._segments[slot] = mem
+				mem, current = current, None
+		if mem is not None:
+			_close_segment(mem, unlink=True)
+
+	def close(self) -> None:
+		"""Unlink all segments held by this pool."""
+		self._finalizer()
+
+	def __reduce__(self):
+		# Clients are pickled when spawning a child process. Segments belong to
+		# the parent, so the child receives an empty pool.
+		return (SharedMemoryPool, (self._prefix,))
+
+	@staticmethod
+	def _release(segments: Dict[str, shared_memory.SharedMemory]) -> None:
+		for mem in segments.values():
+			_close_segment(mem, unlink=True)
+		segments.clear()
+
+
+class SharedMemoryCache:
+	"""Child-side cache of attached shared memory segments.
+
+	Attaching to a segment maps it into the process, so segments are kept
+	attached between requests. Once the parent replaces a slot's segment, the
+	previous mapping for that slot is dropped.
+	"""
+
+	def __init__(self) -> None:
+		self._segments: Dict[str, shared_memory.SharedMemory] = {}
+
+	def attach(self, name: str, shape: Tuple[int, ...], dtype: type) -> np.ndarray:
+		slot = segment_slot(name)
+		mem = self._segments.get(slot)
+		if mem is None or mem.name.lstrip("/") != name.lstrip("/"):
+			if mem is not None:
+				_close_segment(mem, unlink=False)
+			mem = shared_memory.SharedMemory(name=name)
+			self._segments[slot] = mem
+		return np.ndarray(shape, dtype=dtype, buffer=mem.buf)
+
+
+class ControlBlock:
+	"""A small shared memory block the child uses to report liveness.
+
+	The parent creates the block, and the child attaches to it by name when the
+	client is started. The child writes a heartbeat timestamp, a counter of
+	projections completed for the current request, and the time it last made
+	progress, which the parent can read at any time without going through the
+	pipe.
+	"""
+
+	HEARTBEAT = 0  # Time of the child's last heartbeat [s since epoch]
+	DONE = 1  # Projections completed in the current request
+	CANCEL = 2  # Set by the parent to stop the current request early
+	PROGRESS = 3  # Time the child last made progress [s since epoch]
+	FIELDS = 4
+
+	def __init__(self, name: Optional[str] = None) -> None:
+		self._owner = name is None
+		if self._owner:
+			self._mem = shared_memory.SharedMemory(
+				f"WCT_CB-{rng.randint(0, 2**31)}", create=True, size=self.FIELDS * 8
+			)
+		else:
+			self._mem = shared_memory.SharedMemory(name=name)
+		self._values = np.ndarray((self.FIELDS,), dtype=np.float64, buffer=self._mem.buf)
+		if self._owner:
+			self._values[:] = 0
+		self._finalizer = weakref.finalize(self, _close_segment, self._mem, self._owner)
+
+	@property
+	def name(self) -> str:
+		return self._mem.name
+
+	@property
+	def heartbeat(self) -> float:
+		"""Time of the last heartbeat, as returned by `time.time()`."""
+		return float(self._values[self.HEARTBEAT])
+
+	@property
+	def done(self) -> int:
+		"""Number of projections completed in the current request."""
+		return int(self._values[self.DONE])
+
+	@property
+	def progressed(self) -> float:
+		"""Time the child last made progress, as returned by `time.time()`."""
+		return float(self._values[self.PROGRESS])
+
+	@property
+	def cancelled(self) -> bool:
+		"""Whether the parent has asked for the current request to stop."""
+		return self._values is not None and bool(self._values[self.CANCEL])
+
+	def cancel(self) -> None:
+		"""Ask the child to stop the current request."""
+		if self._values is not None:
+			self._values[self.CANCEL] = 1
+
+	def clearCancel(self) -> None:
+		"""Clear a cancellation, must be done before sending a new request."""
+		if self._values is not None:
+			self._values[self.CANCEL] = 0
+
+	def beat(self, done: Optional[int] = None) -> None:
+		"""Record a heartbeat. Passing the completed projection count also
+		records that the child made progress."""
+		now = time.time()
+		if done is not None:
+			self._values[self.DONE] = done
+			self._values[self.PROGRESS] = now
+		self._values[self.HEARTBEAT] = now
+
+	def close(self) -> None:
+		"""Detach from the block, unlinking it if this process created it."""
+		self._values = None
+		self._finalizer()
+
+	def __reduce__(self):
+		# The child attaches to the parent's block rather than creating its own.
+		return (ControlBlock, (self._mem.name,))
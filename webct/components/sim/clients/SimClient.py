@@ -1,16 +1,16 @@
-# todo: should really have some sort of heartbeat for diagnostics.
 # todo: replace defining result_np with a size calculation.
 # todo: split update functions into separate calls
 
 import sys
 import math
+import time
+from threading import Thread
 from time import monotonic
 from dataclasses import dataclass
 from enum import Enum
-from multiprocessing import Pipe, Process, shared_memory
+from multiprocessing import Pipe, Process
 from multiprocessing.connection import Connection
-from random import Random
-from typing import Any, Tuple
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
 import logging
 log = logging.getLogger("Simulator")
 
@@ -19,9 +19,32 @@ from webct.components.Beam import Beam, BeamParameters, Spectra
 from webct.components.Capture import CaptureParameters
 from webct.components.Detector import DetectorParameters
 from webct.components.Samples import RenderedSampleSettings
-from webct.components.sim.simulators.GVXRSimulator import GVXRSimulator
+from webct.components.sim.clients.ScratchPool import ScratchPool, isScratch, openScratch, useScratch
+from webct.components.sim.clients.SharedPool import ControlBlock, SharedMemoryCache, SharedMemoryPool
+from webct.components.sim.simulators.GVXRSimulator import GVXRSimulator, scene_shape
 
-rng = Random()
+
+# Time allowed for the child to publish a block of projections, before its
+# throughput has been measured for the current parameters [s]
+chunk_timeout = 30.0
+
+# Once throughput is known, a child is considered hung if it makes no progress
+# for this many times its expected time per projection, but never less than
+# `min_timeout` seconds.
+timeout_factor = 10.0
+min_timeout = 5.0
+
+# Interval at which the parent checks the child is still alive while waiting [s]
+poll_interval = 0.5
+
+# Interval at which the child publishes a heartbeat [s]
+heartbeat_interval = 0.5
+
+# A heartbeat older than this is reported as the child being unresponsive [s]
+heartbeat_timeout = 5.0
+
+# Measured seconds per projection, keyed by workload (see SimClient.workload)
+throughput: Dict[tuple, float] = {}
 
 
 class SimThreadError(RuntimeError):
@@ -32,6 +55,12 @@ class SimTimeoutError(SimThreadError):
 	pass
 
 
+class SimCancelledError(RuntimeError):
+	"""The parent cancelled a request. The child is healthy, and ready for
+	the next request."""
+	pass
+
+
 @dataclass(frozen=True)
 class STM:
 	pass
@@ -43,15 +72,27 @@ class STM_PROJECTION(STM):
 	result_arr_shape: tuple
 	result_arr_type: type
 
+@dataclass(frozen=True)
+class STM_FLATFIELD(STM):
+	result_sm: Any
+	result_arr_shape: tuple
+	result_arr_type: type
+
 @dataclass(frozen=True)
 class STM_SCENE(STM):
-	pass
+	result_sm: Any
+	result_arr_shape: tuple
 
 @dataclass(frozen=True)
 class STM_ALL_PROJECTION(STM):
 	result_sm: Any
 	result_arr_shape: tuple
 	result_arr_type: type
+	# Range of projections to simulate, defaults to all projections
+	start: int = 0
+	stop: Optional[int] = None
+	# Memory-mapped file to write into instead of shared memory, for large scans
+	result_path: Optional[str] = None
 
 
 @dataclass(frozen=True)
@@ -74,9 +115,32 @@ class STM_CAPTURE(STM):
 	capture: CaptureParameters
 
 
+@dataclass(frozen=True)
+class STM_CONFIG(STM):
+	"""Any subset of parameters, applied together by the child."""
+	beam: Optional[Beam] = None
+	detector: Optional[DetectorParameters] = None
+	samples: Optional[RenderedSampleSettings] = None
+	capture: Optional[CaptureParameters] = None
+	# Session the child serves, which changes once a standby process is claimed
+	sid: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class SimProgress:
+	"""Posted by the child while simulating all projections. Projections within
+	[start, stop) have been written to shared memory, and `done` of the `total`
+	projections in the request are complete."""
+	start: int
+	stop: int
+	done: int
+	total: int
+
+
 class SimResponse(Enum):
 	DONE = 0
 	ERROR = 1
+	CANCELLED = 2
 	REJECTED = 10
 	ACCEPTED = 20
 
@@ -90,8 +154,18 @@ class SimClient(Process):
 	conn_parent: Connection
 	conn_child: Connection
 
+	# Shared memory segments used to transfer results, reused between requests
+	_pool: SharedMemoryPool
+
+	# Memory-mapped files used instead of shared memory for large scans
+	_scratch: ScratchPool
+
+	# Heartbeat and progress published by the child
+	_control: ControlBlock
+
 	# process variables
 	_simulator: GVXRSimulator
+	_attached: SharedMemoryCache
 
 	def __init__(self, sid:str):
 		super(SimClient, self).__init__()
@@ -99,79 +173,130 @@ class SimClient(Process):
 
 		# Session ID is used to relate the simulator client and session
 		self._sid = sid
+		self.detector = None
+		self.capture = None
+		self._samples = ()
+		self._energies = 0
+		# Time allowed for the child to apply the last parameters sent
+		self._config_timeout = 10.0
 
 		self.conn_parent, self.conn_child = Pipe()
+		self._pool = SharedMemoryPool(f"{sid}")
+		self._scratch = ScratchPool(f"{sid}")
+		self._control = ControlBlock()
 
 	def run(self) -> None:
 		# For convention's sake, all 'client' functions are underscored.
 		return self._run()
 
+	def kill(self) -> None:
+		super().kill()
+		self.release()
+
+	def release(self) -> None:
+		"""Unlink shared memory used by this client. Arrays previously returned
+		remain valid until they are garbage collected."""
+		self._pool.close()
+		self._scratch.close()
+		self._control.close()
+
 	# ======================================================== #
 	# ===================== Client Thread ==================== #
 	# ======================================================== #
 
 	def _run(self) -> None:
-		log.info(f"({self.pid}) Client Thread Initialized!")
+		log.info(f"[{self._sid}] ({self.pid}) Client Thread Initialized!")
 		end_thread = False
 		# init
 		self._simulator = GVXRSimulator(sid=self._sid, pid=self.pid)
+		self._attached = SharedMemoryCache()
 		sys.stdout = sys.__stdout__
 		sys.stderr = sys.__stdout__
 
+		# Heartbeat runs alongside requests, so the parent can tell a busy child
+		# from an unresponsive one.
+		Thread(target=self._heartbeat, daemon=True).start()
+
 		while not end_thread:
 			input = self.conn_child.recv()
 			if not isinstance(input, STM):
 				# Not an expected message, ignore.
-				log.info(f"({self.pid}) Got non-STM response from parent?")
+				log.info(f"[{self._sid}] ({self.pid}) Got non-STM response from parent?")
 				self.conn_child.send(SimResponse.REJECTED)
 				continue
 
 			elif isinstance(input, STM_BEAM):
-				log.info(f"({self.pid}) Parent asking for new beam")
+				log.info(f"[{self._sid}] ({self.pid}) Parent asking for new beam")
 				self.conn_child.send(SimResponse.ACCEPTED)
 				self._simulator.beam = input.beam
 				self.conn_child.send(SimResponse.DONE)
 				continue
 
 			elif isinstance(input, STM_DETECTOR):
-				log.info(f"({self.pid}) Parent asking for new detector")
+				log.info(f"[{self._sid}] ({self.pid}) Parent asking for new detector")
 				self.conn_child.send(SimResponse.ACCEPTED)
 				self._simulator.detector = input.detector
 				self.conn_child.send(SimResponse.DONE)
 				continue
 
 			elif isinstance(input, STM_CAPTURE):
-				log.info(f"({self.pid}) Parent asking for new capture")
+				log.info(f"[{self._sid}] ({self.pid}) Parent asking for new capture")
 				self.conn_child.send(SimResponse.ACCEPTED)
 				self._simulator.capture = input.capture
 				self.conn_child.send(SimResponse.DONE)
 				continue
 
 			elif isinstance(input, STM_SAMPLES):
-				log.info(f"({self.pid}) Parent asking for new samples")
+				log.info(f"[{self._sid}] ({self.pid}) Parent asking for new samples")
 				self.conn_child.send(SimResponse.ACCEPTED)
 				for i, value in enumerate(input.samples.samples):
-					log.info(f"({self.pid}) Sample {i}: {value.label} - {value.modelPath} - {value.material.label} - {value.material.density}")
+					log.info(f"[{self._sid}] ({self.pid}) Sample {i}: {value.label} - {value.modelPath} - {value.material.label} - {value.material.density}")
 				self._simulator.samples = input.samples
 				self.conn_child.send(SimResponse.DONE)
 				continue
 
-			elif isinstance(input, STM_SCENE):
-				log.info(f"({self.pid}) Parent asking for rendered scene")
+			elif isinstance(input, STM_CONFIG):
+				if input.sid is not None and input.sid != self._sid:
+					self._claim(input.sid)
+				updates = [key for key in ("beam", "detector", "samples", "capture") if getattr(input, key) is not None]
+				log.info(f"[{self._sid}] ({self.pid}) Parent asking for new {', '.join(updates)}")
 				self.conn_child.send(SimResponse.ACCEPTED)
-				energy_response = self._simulator.RenderScene()
+				self._simulator.configure(
+					beam=input.beam,
+					detector=input.detector,
+					samples=input.samples,
+					capture=input.capture,
+				)
 				self.conn_child.send(SimResponse.DONE)
-				self.conn_child.send(energy_response)
+				continue
+
+			elif isinstance(input, STM_SCENE):
+				log.info(f"[{self._sid}] ({self.pid}) Parent asking for rendered scene")
+				self.conn_child.send(SimResponse.ACCEPTED)
+				scene = self._simulator.RenderScene()
+
+				if scene.shape == tuple(input.result_arr_shape):
+					sm_arr: np.ndarray = self._attached.attach(input.result_sm, input.result_arr_shape, np.uint8)
+					np.copyto(sm_arr, scene)
+					del sm_arr
+					self.conn_child.send(SimResponse.DONE)
+					self.conn_child.send(None)
+				else:
+					# The window may not be the requested size (such as on high
+					# DPI displays), so fall back to sending the array itself.
+					log.warning(f"[{self._sid}] ({self.pid}) Scene of shape {scene.shape} does not fit {input.result_arr_shape}, sending through pipe")
+					self.conn_child.send(SimResponse.DONE)
+					self.conn_child.send(scene)
+				continue
 
 			elif isinstance(input, STM_PROJECTION):
-				log.info(f"({self.pid}) Parent asking for single rendered projection")
-				log.info(f"({self.pid}) Using shared memory instance [[{input.result_sm}]] : {input.result_arr_shape}")
-				mem = shared_memory.SharedMemory(name=input.result_sm)
-				# Wrap shared memory as np array
-				sm_arr: np.ndarray = np.ndarray(
+				log.info(f"[{self._sid}] ({self.pid}) Parent asking for single rendered projection")
+				log.info(f"[{self._sid}] ({self.pid}) Using shared memory instance [[{input.result_sm}]] : {input.result_arr_shape}")
+				# Wrap shared memory as np array, segments are reused between requests
+				sm_arr: np.ndarray = self._attached.attach(
+					input.result_sm,
 					input.result_arr_shape,
-					dtype=input.result_arr_type,
-					buffer=mem.buf,
+					input.result_arr_type,
 				)
 
 				# Setup done, signal to parent and start simulation
@@ -179,48 +304,88 @@ class SimClient(Process):
 
 				# copy values into shared memory
 				tik = monotonic()
-				log.info(f"({self.pid}) Filling [[{input.result_sm}]] with a single projection")
+				log.info(f"[{self._sid}] ({self.pid}) Filling [[{input.result_sm}]] with a single projection")
 				np.copyto(sm_arr, self._simulator.SimSingleProjection())
-				log.info(f"({self.pid}) [[{input.result_sm}]] Filled with a single projection in {monotonic() - tik:.2f}s")
+				log.info(f"[{self._sid}] ({self.pid}) [[{input.result_sm}]] Filled with a single projection in {monotonic() - tik:.2f}s")
 
-				# ? Would normally close memory, but causes issues on windows
-				# ? due to python bugs (plz merge the fix python comittiee <3)
-				# del sm_arr
-				# mem.close()
+				# Memory is kept attached, as the parent reuses segments.
+				del sm_arr
 
 				# Respond with completed.
 				self.conn_child.send(SimResponse.DONE)
 				continue
 
-			elif isinstance(input, STM_ALL_PROJECTION):
-				log.info(f"({self.pid}) Parent asking for all rendered projection")
-				log.info(f"({self.pid}) Using shared memory instance [[{input.result_sm}]] : {input.result_arr_shape}")
-				mem = shared_memory.SharedMemory(name=input.result_sm)
-				# Wrap shared memory as np array
-				sm_arr: np.ndarray = np.ndarray(
+			elif isinstance(input, STM_FLATFIELD):
+				log.info(f"[{self._sid}] ({self.pid}) Parent asking for flat field")
+				sm_arr: np.ndarray = self._attached.attach(
+					input.result_sm,
 					input.result_arr_shape,
-					dtype=input.result_arr_type,
-					buffer=mem.buf,
+					input.result_arr_type,
 				)
+				self.conn_child.send(SimResponse.ACCEPTED)
+				np.copyto(sm_arr, self._simulator.SimFlatField())
+				del sm_arr
+				self.conn_child.send(SimResponse.DONE)
+				continue
+
+			elif isinstance(input, STM_ALL_PROJECTION):
+				log.info(f"[{self._sid}] ({self.pid}) Parent asking for all rendered projection")
+				if input.result_path is not None:
+					# Large scans are written straight into a file on the scratch volume.
+					log.info(f"[{self._sid}] ({self.pid}) Using scratch file [[{input.result_path}]] : {input.result_arr_shape}")
+					sm_arr: np.ndarray = openScratch(input.result_path, input.result_arr_shape, input.result_arr_type)
+				else:
+					log.info(f"[{self._sid}] ({self.pid}) Using shared memory instance [[{input.result_sm}]] : {input.result_arr_shape}")
+					# Wrap shared memory as np array, segments are reused between requests
+					sm_arr: np.ndarray = self._attached.attach(
+						input.result_sm,
+						input.result_arr_shape,
+						input.result_arr_type,
+					)
 
 				# Setup done, signal to parent and start simulation
 				self.conn_child.send(SimResponse.ACCEPTED)
 
 				# copy values into shared memory
 				tik = monotonic()
-				log.info(f"({self.pid}) Filling [[{input.result_sm}]] with all projections")
-				np.copyto(sm_arr, self._simulator.SimAllProjections())
-				log.info(f"({self.pid}) [[{input.result_sm}]] Filled with all projections in {monotonic() - tik:.2f}s")
+				first = input.start
+				last = input.result_arr_shape[0] if input.stop is None else input.stop
+				log.info(f"[{self._sid}] ({self.pid}) Filling [[{input.result_sm}]] with projections {first} to {last}")
+
+				def publish(start: int, stop: int) -> None:
+					self._control.beat(stop - first)
+					if stop > start:
+						self.conn_child.send(SimProgress(start, stop, stop - first, last - first))
+
+				self._control.beat(0)
+				self._simulator.SimAllProjections(sm_arr, publish, first, last, lambda: self._control.cancelled)
+
+				# Memory is kept attached until the parent allocates the next scan.
+				del sm_arr
 
-				# ? Would normally close memory, but causes issues on windows
-				# ? due to python bugs (plz merge the fix python comittiee <3)
-				# del sm_arr
-				# mem.close()
+				# Progress is always published for the final projection.
+				if self._control.done < last - first:
+					log.info(f"[{self._sid}] ({self.pid}) [[{input.result_sm}]] Cancelled after {self._control.done} projections")
+					self.conn_child.send(SimResponse.CANCELLED)
+					continue
+
+				log.info(f"[{self._sid}] ({self.pid}) [[{input.result_sm}]] Filled with {last - first} projections in {monotonic() - tik:.2f}s")
 
 				# Respond with completed.
 				self.conn_child.send(SimResponse.DONE)
 				continue
 
+	def _claim(self, sid: str) -> None:
+		"""Tag logs with the session a standby process now serves."""
+		log.info(f"[{self._sid}] ({self.pid}) Claimed by session [{sid}]")
+		self._sid = sid
+		self._simulator.setSession(sid)
+
+	def _heartbeat(self) -> None:
+		while True:
+			self._control.beat()
+			time.sleep(heartbeat_interval)
+
 	# ======================================================== #
 	# ==================== Parent Methods ==================== #
 	# ======================================================== #
@@ -241,11 +406,87 @@ class SimClient(Process):
 		return
 
 	def response(self, timeout=10.0, msg="Sim timeout during request. Crashed?"):
-		if not self.conn_parent.poll(timeout):
-			raise SimTimeoutError(msg)
+		# Wait in short slices, so a child that has exited is noticed straight
+		# away rather than at the end of the timeout.
+		deadline = monotonic() + timeout
+		while not self.conn_parent.poll(poll_interval):
+			self.checkAlive()
+			if monotonic() > deadline:
+				raise SimTimeoutError(msg)
 		return self.conn_parent.recv()
 
+	def checkAlive(self) -> None:
+		"""Raise a SimThreadError if the child process has exited."""
+		if not self.is_alive():
+			raise SimThreadError(f"Simulator child {self.pid} exited unexpectedly with code {self.exitcode}")
+
+	def cancel(self) -> None:
+		"""Ask the child to stop simulating projections. The request in flight
+		ends with a SimCancelledError, and the cancellation stays in effect
+		until `clearCancel` is called."""
+		self._control.cancel()
+
+	def clearCancel(self) -> None:
+		"""Allow new requests to run after a cancellation."""
+		self._control.clearCancel()
+
+	def heartbeatAge(self) -> float:
+		"""Seconds since the child last published a heartbeat."""
+		return time.time() - self._control.heartbeat
+
+	@property
+	def completed(self) -> int:
+		"""Projections completed by the child in the current request."""
+		return self._control.done
+
+	def workload(self) -> tuple:
+		"""Key describing the cost of a projection with the current parameters."""
+		shape = None if self.detector is None else tuple(self.detector.binned_shape)
+		return (shape, self._samples, self._energies)
+
+	def expectedTime(self) -> Optional[float]:
+		"""Measured seconds per projection for the current workload, if known."""
+		return throughput.get(self.workload())
+
+	def measure(self, seconds: float, projections: int = 1) -> None:
+		"""Record the time taken to simulate a number of projections."""
+		if projections <= 0:
+			return
+		key = self.workload()
+		rate = seconds / projections
+		previous = throughput.get(key)
+		# Smooth measurements, as a single projection is a noisy sample.
+		throughput[key] = rate if previous is None else 0.5 * (previous + rate)
+
+	def stallTimeout(self) -> float:
+		"""Time the child may go without completing a projection before it is
+		considered hung."""
+		expected = self.expectedTime()
+		if expected is None:
+			return chunk_timeout
+		return max(min_timeout, timeout_factor * expected)
+
+	def checkProgress(self, since: float) -> None:
+		"""Raise if the child has exited, or has made no progress within the
+		stall timeout since `since`, a `monotonic()` time.
+
+		Progress is also read from the control block, which the child updates
+		without a message, such as once the white image of a scan is raytraced.
+		The heartbeat is only reported, as a raytrace may hold the GIL and delay
+		it, so it never shortens the stall timeout.
+		"""
+		self.checkAlive()
+		stalled = min(monotonic() - since, time.time() - self._control.progressed)
+		if stalled > self.stallTimeout():
+			age = self.heartbeatAge()
+			state = "unresponsive" if age > heartbeat_timeout else "alive"
+			raise SimTimeoutError(
+				f"Simulator child {self.pid} made no progress for {stalled:.1f}s after {self.completed} projections "
+				f"(heartbeat {age:.1f}s ago, {state})."
+			)
+
 	def setBeam(self, beam_params: BeamParameters, spectra: Spectra):
+		self._energies = len(spectra.energies)
 		request = STM_BEAM(Beam(beam_params, spectra))
 		self.conn_parent.send(request)
 
@@ -312,6 +553,7 @@ class SimClient(Process):
 			)
 
 	def setSamples(self, samples: RenderedSampleSettings):
+		self._samples = tuple(sample.modelPath for sample in samples.samples)
 		request = STM_SAMPLES(samples)
 		self.conn_parent.send(request)
 
@@ -329,90 +571,210 @@ class SimClient(Process):
 		else:
 			raise SimThreadError(f"Unexpected response: {response}, wanted SimResponse.DONE")
 
+	def setConfig(self, beam: Optional[Beam] = None, detector: Optional[DetectorParameters] = None,
+			samples: Optional[RenderedSampleSettings] = None, capture: Optional[CaptureParameters] = None):
+		"""Send any subset of parameters to the child in a single request."""
+		self.sendConfig(beam, detector, samples, capture)
+		self.awaitConfig()
+
+	def sendConfig(self, beam: Optional[Beam] = None, detector: Optional[DetectorParameters] = None,
+			samples: Optional[RenderedSampleSettings] = None, capture: Optional[CaptureParameters] = None):
+		"""Send parameters to the child without waiting for them to be applied.
+
+		Must be followed by `awaitConfig`, so several children can load
+		parameters at the same time.
+		"""
+		# detector and capture used for preallocation
+		if detector is not None:
+			self.detector = detector
+		if capture is not None:
+			self.capture = capture
+		# beam and samples are used to estimate the cost of a projection
+		if beam is not None:
+			self._energies = len(beam.spectra.energies)
+		if samples is not None:
+			self._samples = tuple(sample.modelPath for sample in samples.samples)
+
+		# The session ID is sent with every config, so a claimed standby child
+		# tags its logs with the session it now serves.
+		request = STM_CONFIG(beam, detector, samples, capture, sid=self._sid)
+		self.conn_parent.send(request)
+		# Loading samples can take a while.
+		self._config_timeout = 30.0 if samples is not None else 10.0
+
+	def awaitConfig(self):
+		"""Wait for the child to apply parameters sent with `sendConfig`."""
+		# Check for accepted response
+		self.check_confirm()
+
+		# Response accepted, wait for done signal.
+		response = self.response(timeout=self._config_timeout, msg="Sim timeout while setting config.")
+
+		# Parse simulation response
+		if not isinstance(response, SimResponse):
+			raise SimThreadError(f"Expected a response, but got a {type(response)}")
+		elif response is SimResponse.DONE:
+			return
+		else:
+			raise SimThreadError(f"Unexpected response: {response}, wanted SimResponse.DONE")
+
 	def getProjection(self) -> np.ndarray:
 		if self.detector is None:
 			raise AssertionError("Detector parameters were not set before calling getProjection")
 
-		# allocate shared memory
-		result_np: np.ndarray = np.ndarray(self.detector.binned_shape, dtype=float)
-		mem = shared_memory.SharedMemory(
-			f"WCT_SM_GP-{self.pid}-{rng.random()}", create=True, size=result_np.nbytes
-		)
-
-		# ! Due to a bug in python, we need to explicitly access the shared
-		# ! memory, otherwise it'll get deleted when the child process closes.
-		# ! https://bugs.python.org/issue38119
-		# ! (please merge the patch, it's been more than 3 years...)
 		# ! Do not use sm_arr until an explicit DONE is received by the child.
-		sm_arr: np.ndarray = np.ndarray(
-			result_np.shape,
-			dtype=float,
-			buffer=mem.buf,
-		)
-
-		request = STM_PROJECTION(mem.name, result_np.shape, float)
-
-		# deallocate result_np immediately
-		del result_np
+		name, sm_arr = self._pool.get("projection", self.detector.binned_shape, np.float32)
+		request = STM_PROJECTION(name, sm_arr.shape, np.float32)
 
 		# Send process request
 		self.conn_parent.send(request)
 
 		# Check for confirmation
+		tik = monotonic()
 		self.check_confirm()
 
 		# Response accepted, wait for done signal
-		response = self.response(timeout=30, msg="Sim timeout while simulating.")
+		response = self.response(timeout=self.stallTimeout(), msg="Sim timeout while simulating.")
 
 		# Parse simulation response
 		if not isinstance(response, SimResponse):
 			raise SimThreadError(f"Expected a response, but got a {type(response)}")
 		elif response is SimResponse.DONE:
-			# Copy data to managed np array, close and deallocate shared space.
-			result: np.ndarray = np.empty(sm_arr.shape)
-			np.copyto(result, sm_arr)
-
-			# deallocate
-			mem.close()
-			mem.unlink()
-
-			# return result
-			return result.astype(np.float32)
+			self.measure(monotonic() - tik)
+			# Copy out of shared memory, as the segment is reused by the next request.
+			return sm_arr.copy()
 		else:
 			raise SimThreadError(
 				f"Unexpected response: {response}, wanted SimResponse.DONE"
 			)
 
-	def getAllProjections(self) -> np.ndarray:
+	def getFlatField(self) -> np.ndarray:
+		"""Returns the image of the beam with no samples, as used to flat-field
+		correct projections."""
+		if self.detector is None:
+			raise AssertionError("Detector parameters were not set before calling getFlatField")
+
+		# ! Do not use sm_arr until an explicit DONE is received by the child.
+		name, sm_arr = self._pool.get("flatfield", self.detector.binned_shape, np.float32)
+		request = STM_FLATFIELD(name, sm_arr.shape, np.float32)
+		self.conn_parent.send(request)
+		self.check_confirm()
+
+		response = self.response(timeout=self.stallTimeout(), msg="Sim timeout while simulating flat field.")
+		if not isinstance(response, SimResponse):
+			raise SimThreadError(f"Expected a response, but got a {type(response)}")
+		elif response is SimResponse.DONE:
+			return sm_arr.copy()
+		else:
+			raise SimThreadError(f"Unexpected response: {response}, wanted SimResponse.DONE")
+
+	def streamAllProjections(self) -> Iterator[Tuple[np.ndarray, SimProgress]]:
+		"""Simulate all projections into shared memory, yielding as blocks land.
+
+		The child writes float32 projections directly into a pooled segment,
+		and posts a `SimProgress` for each block of completed angles. Each
+		update is yielded with a read-only view of the whole stack, of which
+		only completed blocks are valid. The generator must be exhausted before
+		making any other request to the client.
+
+		The stack keeps its segment until it and every view of it are
+		collected, so views stay valid after the scan. The segment is then
+		reused by a later scan.
+
+		Raises:
+			SimCancelledError: The scan was cancelled with `cancel`. The client
+				remains usable.
+		"""
 		log.info(f"[{self._sid}] Generating {self.capture.projections} projections")
+
+		# ! Only read projections from sm_arr once the child has published them.
+		name, sm_arr = self.allocateProjections()
+		tik = monotonic()
+		self.requestProjections(name, sm_arr.shape)
+
+		# The timeout is a liveness check for a single projection rather than
+		# the full scan, scaled by the measured time per projection.
+		log.info(f"[{self._sid}] Child ({self.pid}) has {self.stallTimeout():.1f}s to complete each projection, or they will be killed.")
+
+		heard = monotonic()
+		try:
+			while True:
+				if not self.conn_parent.poll(poll_interval):
+					self.checkProgress(heard)
+					continue
+				response = self.conn_parent.recv()
+				heard = monotonic()
+
+				# Parse simulation response
+				if isinstance(response, SimProgress):
+					yield sm_arr, response
+				elif not isinstance(response, SimResponse):
+					raise SimThreadError(f"Expected a response, but got a {type(response)}")
+				elif response is SimResponse.DONE:
+					self.measure(monotonic() - tik, sm_arr.shape[0])
+					return
+				elif response is SimResponse.CANCELLED:
+					raise SimCancelledError("Simulation of all projections was cancelled.")
+				else:
+					raise SimThreadError(
+						f"Unexpected response: {response}, wanted SimResponse.DONE"
+					)
+		finally:
+			# Views have been handed out, so the segment must not be reused.
+			self.detachProjections(name, sm_arr)
+
+	def allocateProjections(self) -> Tuple[str, np.ndarray]:
+		"""Allocate shared memory for a full scan. Scans of at least
+		`memmap_threshold` bytes are instead memory mapped from a file in the
+		scratch folder, if one is set.
+
+		Once the scan ends, pass the result to `detachProjections`.
+
+		Returns:
+			Tuple[str, np.ndarray]: Name of the segment or path of the file, and
+				a read-only view of it.
+		"""
 		if self.detector is None:
 			raise AssertionError("Detector parameters were not set before calling getProjections")
 
 		shape = (self.capture.projections, *self.detector.binned_shape)
+		nbytes = math.prod(shape) * 4
+		size_GiB = nbytes / 1024 / 1024 / 1024
 
-		# allocate shared memory
-		size_GiB = (math.prod(shape) * 4) / 1024 / 1024 / 1024
-		log.info(f"Attempting to allocate {size_GiB * 2:.2f} GiB")
-		result_np: np.ndarray = np.ndarray(shape, dtype=float)
-		mem = shared_memory.SharedMemory(
-			f"WCT_SM_GP-{self.pid}-{rng.random()}", create=True, size=result_np.nbytes
-		)
-
-		# ! Due to a bug in python, we need to explicitly access the shared
-		# ! memory, otherwise it'll get deleted when the child process closes.
-		# ! https://bugs.python.org/issue38119
-		# ! (please merge the patch, it's been more than 3 years...)
-		# ! Do not use sm_arr until an explicit DONE is received by the child.
-		sm_arr: np.ndarray = np.ndarray(
-			shape,
-			dtype=float,
-			buffer=mem.buf,
-		)
-
-		request = STM_ALL_PROJECTION(mem.name, result_np.shape, float)
-
-		# deallocate result_np immediately
-		del result_np
+		if useScratch(nbytes):
+			log.info(f"Attempting to allocate {size_GiB:.2f} GiB on scratch")
+			name, sm_arr = self._scratch.get("projections", shape, np.float32)
+		else:
+			log.info(f"Attempting to allocate {size_GiB:.2f} GiB")
+			name, sm_arr = self._pool.get("projections", shape, np.float32)
+		sm_arr.flags.writeable = False
+		return name, sm_arr
+
+	def detachProjections(self, name: str, projections: np.ndarray) -> None:
+		"""Hand a scan allocated by `allocateProjections` over to the caller.
+
+		While a session, download or reconstruction still reads the stack, the
+		next scan is given a fresh segment or file, so it is never overwritten.
+		Once the stack and all views of it are collected, the segment or file
+		returns to the pool for later scans.
+		"""
+		if isScratch(name):
+			self._scratch.detach("projections", projections)
+		else:
+			self._pool.detach("projections", projections)
+
+	def requestProjections(self, name: str, shape: tuple, start: int = 0, stop: Optional[int] = None) -> None:
+		"""Ask the child to simulate a range of projections into shared memory,
+		or the scratch file allocated by `allocateProjections`.
+
+		The child responds with `SimProgress` messages, followed by
+		`SimResponse.DONE`, or `SimResponse.CANCELLED` if `cancel` was called.
+		"""
+		# Shards of a scan may use a file allocated by another client.
+		if isScratch(name):
+			request = STM_ALL_PROJECTION(None, shape, np.float32, start, stop, result_path=name)
+		else:
+			request = STM_ALL_PROJECTION(name, shape, np.float32, start, stop)
 
 		# Send process request
 		self.conn_parent.send(request)
@@ -420,34 +782,32 @@ class SimClient(Process):
 		# Check for confirmation
 		self.check_confirm()
 
-		# set timeout to number of projections, this is a worst-case scenario for most systems.
-		timeout = self.capture.projections
-		log.info(f"[{self._sid}] Child ({self.pid}) has {timeout}s to generate {self.capture.projections} projections, or they will be killed.")
-
-		# Response accepted, wait for done signal
-		response = self.response(timeout=timeout, msg="Sim timeout while simulating.")
-
-		# Parse simulation response
-		if not isinstance(response, SimResponse):
-			raise SimThreadError(f"Expected a response, but got a {type(response)}")
-		elif response is SimResponse.DONE:
-			# Copy data to managed np array, close and deallocate shared space.
-			result: np.ndarray = np.empty(sm_arr.shape)
-			np.copyto(result, sm_arr)
-
-			# deallocate
-			mem.close()
-			mem.unlink()
+	def getAllProjections(self, progress: Optional[Callable[[np.ndarray, SimProgress], None]] = None) -> np.ndarray:
+		"""Simulate all projections, returning a read-only view of shared memory.
 
-			# return result
-			return result.astype(np.float32)
-		else:
-			raise SimThreadError(
-				f"Unexpected response: {response}, wanted SimResponse.DONE"
-			)
+		Args:
+			progress (Callable[[np.ndarray, SimProgress], None], optional): Called
+				with the projection stack each time a block of projections lands.
+		"""
+		projections = None
+		for projections, update in self.streamAllProjections():
+			if progress is None:
+				continue
+			try:
+				progress(projections, update)
+			except Exception:
+				# The stream must be drained to keep the pipe in sync with the child.
+				log.exception(f"[{self._sid}] Progress callback failed, ignoring further updates")
+				progress = None
+		if projections is None:
+			raise SimThreadError("Simulator finished without publishing any projections")
+		return projections
 
 	def getScene(self) -> np.ndarray:
-		request = STM_SCENE()
+		"""Render the scene, returning an 8-bit RGB image."""
+		# ! Do not use sm_arr until an explicit DONE is received by the child.
+		name, sm_arr = self._pool.get("scene", scene_shape, np.uint8)
+		request = STM_SCENE(name, sm_arr.shape)
 		self.conn_parent.send(request)
 		self.check_confirm()
 		response = self.response(msg="sim timeout while rendering scene.")
@@ -456,9 +816,12 @@ class SimClient(Process):
 			raise SimThreadError(f"Expected a response, but got a {type(response)}")
 		elif response is SimResponse.DONE:
 			scene = self.response(msg="sim timeout while generating scene.")
-			if not isinstance(scene, tuple):
-				raise SimThreadError(f"Unexpected scene type of '{type(scene)}', expected 'tuple'")
-			return np.asarray(scene)
+			if scene is None:
+				# Copy out of shared memory, as the segment is reused by the next request.
+				return sm_arr.copy()
+			if not isinstance(scene, np.ndarray):
+				raise SimThreadError(f"Unexpected scene type of '{type(scene)}', expected 'ndarray'")
+			return scene
 		else:
 			raise SimThreadError(
 				f"Unexpected response: {response}, wanted SimResponse.DONE"
@@ -0,0 +1,111 @@
+"""Detector effects applied to raw images with numpy, rather than by gvxr.
+
+gvxr bakes the line spread function, energy response, and pixel binning into
+every image it computes, so changing any of them means raytracing again.
+Instead, the simulator can raytrace once at the detector's native resolution,
+and apply these effects here. Combined with cached path lengths (see
+`PathLength`), detector changes then never go back to the raytracer.
+"""
+
+from typing import Optional, Tuple
+
+import numpy as np
+
+from webct.components.Detector import SCINTILLATOR_MATERIAL, DetectorParameters, Scintillator
+
+# Apply the LSF and binning to images with numpy, on images raytraced at the
+# detector's native resolution. The energy response is applied by weighting
+# energy bins, so is only handled here for path length projections.
+enable_detector_effects = False
+
+
+def rawShape(detector: DetectorParameters) -> Tuple[int, int]:
+	"""Shape of the unbinned detector, which raw images are raytraced at."""
+	return tuple(int(t / detector.pixel_size) for t in (detector.pane_height, detector.pane_width))
+
+
+def energyResponse(energies: np.ndarray, scintillator: Scintillator) -> np.ndarray:
+	"""Energy recorded by the detector for photons of each incident energy [keV]."""
+	if scintillator.material == SCINTILLATOR_MATERIAL.NONE:
+		return np.asarray(energies, dtype=np.float64)
+
+	response = scintillator.custom_response if scintillator.isCustom else scintillator.response
+	return np.interp(energies, response.incident, response.output)
+
+
+def blur(image: np.ndarray, lsf: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+	"""Convolve an image with a line spread function along both axes, using FFTs.
+
+	Edges are padded with their nearest value, so the borders of a flat image
+	are not darkened.
+	"""
+	kernel = np.asarray(lsf, dtype=np.float32)
+	kernel = kernel / kernel.sum()
+	half = len(kernel) // 2
+
+	result = image
+	for axis in (0, 1):
+		length = result.shape[axis]
+		padding = [(0, 0), (0, 0)]
+		padding[axis] = (half, half)
+		padded = np.pad(result, padding, mode="edge")
+
+		size = padded.shape[axis] + len(kernel) - 1
+		spectrum = np.fft.rfft(padded, size, axis=axis)
+		spectrum *= np.fft.rfft(kernel, size).reshape((-1, 1) if axis == 0 else (1, -1))
+		result = np.fft.irfft(spectrum, size, axis=axis)
+
+		# Keep the region aligned with the original image.
+		result = np.take(result, np.arange(2 * half, 2 * half + length), axis=axis)
+
+	if out is None:
+		return result.astype(np.float32)
+	np.copyto(out, result)
+	return out
+
+
+def binPixels(image: np.ndarray, binning: int, shape: Optional[Tuple[int, int]] = None, out: Optional[np.ndarray] = None) -> np.ndarray:
+	"""Average blocks of `binning` x `binning` pixels. Any remainder is
+	cropped evenly from both sides, keeping the image centred.
+
+	If a binned `shape` is given, an image too small to fill it is padded
+	with its nearest values instead.
+	"""
+	if shape is None:
+		shape = (image.shape[0] // binning, image.shape[1] // binning)
+	height, width = shape
+
+	shortfall = (max(0, height * binning - image.shape[0]), max(0, width * binning - image.shape[1]))
+	if any(shortfall):
+		image = np.pad(image, [(s // 2, s - s // 2) for s in shortfall], mode="edge")
+
+	top = (image.shape[0] - height * binning) // 2
+	left = (image.shape[1] - width * binning) // 2
+
+	cropped = image[top:top + height * binning, left:left + width * binning]
+	return np.mean(cropped.reshape(height, binning, width, binning), axis=(1, 3), dtype=np.float32, out=out)
+
+
+def detect(image: np.ndarray, detector: DetectorParameters, out: Optional[np.ndarray] = None) -> np.ndarray:
+	"""Apply the LSF and pixel binning to a raw image.
+
+	Args:
+		image (np.ndarray): (height, width) image at the detector's native resolution.
+		detector (DetectorParameters): Detector to apply.
+		out (np.ndarray, optional): Array of the detector's binned shape to write into.
+
+	Returns:
+		np.ndarray: The image as recorded by the detector.
+	"""
+	if detector.enableLSF and detector.lsf is not None and len(detector.lsf) > 1:
+		image = blur(image, detector.lsf)
+
+	# Rounding can leave the binned raw image a pixel off the detector's
+	# binned shape, which images must match exactly.
+	shape = detector.binned_shape
+	if detector.binning > 1 or image.shape != shape:
+		return binPixels(image, detector.binning, shape, out)
+	if out is None:
+		return np.asarray(image, dtype=np.float32)
+	np.copyto(out, image)
+	return out
@@ -1,10 +1,13 @@
 from datetime import datetime
-from typing import List, Tuple, cast
+from time import monotonic
+from typing import Callable, List, Optional, Tuple
 from gvxrPython3 import gvxr
 import numpy as np
 import os
+import logging
+log = logging.getLogger("Simulator")
 
-from webct.components.Beam import PROJECTION, Beam, LabBeam, MedBeam, SynchBeam
+from webct.components.Beam import PROJECTION, Beam
 from webct.components.Capture import CaptureParameters
 from webct.components.Detector import SCINTILLATOR_MATERIAL, DetectorParameters
 from webct.components.Material import (
@@ -14,12 +17,38 @@ from webct.components.Material import (
 	Material,
 	MixtureMaterial,
 )
-from webct.components.Samples import RenderedSampleSettings
-from webct.components.sim.simulators.Simulator import Simulator
+from webct.components.Samples import RenderedSample, RenderedSampleSettings
+from webct.components.sim.simulators import DetectorEffects, PathLength
+from webct.components.sim.simulators.DetectorEffects import detect, energyResponse, rawShape
+from webct.components.sim.simulators.MeshCache import MeshCache
+from webct.components.sim.simulators.PathLength import PathLengthCache, lbuffer_to_cm, transmission
+from webct.components.sim.simulators.Simulator import Simulator, progress_interval
 from webct import model_folder
 from matplotlib.colors import hsv_to_rgb
 from zlib import crc32
 
+# Size of the OpenGL window used to render the scene [px]
+window_width = 1800
+window_height = 600
+
+# Shape of scene renders returned by RenderScene
+scene_shape = (window_height, window_width, 3)
+
+# Axis the root node is rotated about between projections
+scan_axis = (0.0, 0.0, 1.0)
+
+def rotation_matrix(angle: float, axis: Tuple[float, float, float]) -> np.ndarray:
+	"""4x4 matrix rotating by `angle` degrees about `axis`, as built by gvxr's rotateNode."""
+	x, y, z = np.asarray(axis, dtype=np.float64) / np.linalg.norm(axis)
+	c, s = np.cos(np.radians(angle)), np.sin(np.radians(angle))
+	t = 1 - c
+	return np.array([
+		[t * x * x + c, t * x * y - s * z, t * x * z + s * y, 0],
+		[t * x * y + s * z, t * y * y + c, t * y * z - s * x, 0],
+		[t * x * z - s * y, t * y * z + s * x, t * z * z + c, 0],
+		[0, 0, 0, 1],
+	])
+
 def colour_from_string(string:str) -> Tuple[float,float,float]:
 	"""Deterministically Creates a rgb colour from a given string.
 		The same text input will always return the same colour.
@@ -42,13 +71,30 @@ class GVXRSimulator(Simulator):
 	def __init__(self, sid:str, pid:int):
 		super().__init__(sid=sid, pid=pid)
 		self.firstSetup = False
+		self._meshes = MeshCache()
+		# White image for the current beam, detector, and geometry.
+		self._white: Optional[np.ndarray] = None
+		# White image at the detector's native resolution, with detector effects.
+		self._raw_white: Optional[np.ndarray] = None
+		# White image of the previous detector, as coarse previews switch the
+		# detector back and forth.
+		self._previous_white: Optional[Tuple[DetectorParameters, np.ndarray]] = None
+		self._paths = PathLengthCache()
+		self._useLogFile()
+		self._initRenderer()
+
+	def _useLogFile(self) -> None:
 		os.makedirs(f"logs/{datetime.now().strftime('%Y-%m-%d')}/", exist_ok=True)
 		gvxr.useLogFile(f"logs/{datetime.now().strftime('%Y-%m-%d')}/GVXR-{datetime.now().strftime('%H-%M')}-{self._sid}-{self._pid}.log")
-		self._initRenderer()
+
+	def setSession(self, sid: str) -> None:
+		"""Switch to a log file named for the session a standby process now serves."""
+		super().setSession(sid)
+		self._useLogFile()
 
 	def _initRenderer(self):
 		gvxr.createWindow(-1, 0, "OpenGL")
-		gvxr.setWindowSize(1800, 600)
+		gvxr.setWindowSize(window_width, window_height)
 
 		gvxr.removePolygonMeshesFromSceneGraph()
 		gvxr.disableArtefactFiltering()
@@ -67,13 +113,50 @@ class GVXRSimulator(Simulator):
 		# if no samples are loaded, gvxr crashes.
 		# As a workaround, simulate white images if the number of samples is 0.
 		# This makes it easier to deal with on the frontend.
-		white = np.asarray(gvxr.getWhiteImage())
 		if len(self.samples.samples) == 0:
+			white = self.SimFlatField()
 			return white / white.max()
+		elif self._usePathLength():
+			# Already relative to a flat field, so no white image is raytraced.
+			image = transmission(self._pathLengths(0), *self._attenuation())
+			return detect(image, self.detector) if DetectorEffects.enable_detector_effects else image
+		elif DetectorEffects.enable_detector_effects:
+			return detect(np.asarray(gvxr.computeXRayImage(), dtype=np.float32), self.detector) / self.SimFlatField()
 		else:
-			return np.asarray(gvxr.computeXRayImage()) / white
+			return np.asarray(gvxr.computeXRayImage(), dtype=np.float32) / self.SimFlatField()
 
-	def SimAllProjections(self) -> np.ndarray:
+	def SimFlatField(self) -> np.ndarray:
+		# Cached until the beam, detector, or geometry changes.
+		if self._white is None:
+			if DetectorEffects.enable_detector_effects:
+				self._white = detect(self._rawWhite(), self.detector)
+			else:
+				self._white = np.asarray(gvxr.getWhiteImage(), dtype=np.float32)
+			self._white.flags.writeable = False
+		return self._white
+
+	def _clearWhite(self) -> None:
+		"""Drop white images, after the beam or geometry changes."""
+		self._white = self._raw_white = self._previous_white = None
+
+	def _swapWhite(self, value: DetectorParameters) -> Optional[np.ndarray]:
+		"""Keep the white image of the current detector, and return the one kept
+		for `value`, if any."""
+		kept = self._previous_white
+		self._previous_white = None if self._white is None else (self._detector, self._white)
+		if kept is not None and kept[0] == value:
+			return kept[1]
+		return None
+
+	def _rawWhite(self) -> np.ndarray:
+		"""White image before detector effects, only used with
+		`DetectorEffects.enable_detector_effects`. Kept across LSF and binning changes."""
+		if self._raw_white is None:
+			self._raw_white = np.asarray(gvxr.getWhiteImage(), dtype=np.float32)
+		return self._raw_white
+
+	def SimAllProjections(self, out: np.ndarray, progress: Optional[Callable[[int, int], None]] = None, start: int = 0, stop: Optional[int] = None,
+			cancelled: Optional[Callable[[], bool]] = None) -> np.ndarray:
 		# workaround, doesn't seem to be set properly in init
 		gvxr.disableArtefactFiltering()
 
@@ -81,19 +164,118 @@ class GVXRSimulator(Simulator):
 		# gvxr.computeCTAcquisition("", "", self.capture.projections, 0, False, self.capture.angles[-1], 1, 0, 0, 0, "mm", 0, 0, 1, True, 1)
 		# images = np.asarray(gvxr.getLastProjectionSet())
 
-		white = gvxr.getWhiteImage()
-		im1 = np.asarray(gvxr.computeXRayImage())
-		images = np.empty((self.capture.projections, *im1.shape))
-
-		images[0] = im1
+		# Projections for a known geometry are combined from cached path lengths.
+		# These are already relative to a flat field, so no white image is raytraced.
+		attenuation = self._attenuation() if self._usePathLength() else None
+		white = self.SimFlatField() if attenuation is None else None
+		if progress is not None:
+			# The white image may take as long as a projection to raytrace.
+			progress(start, start)
+
+		# With detector effects, frames are raytraced at the native resolution
+		# then blurred and binned into the output.
+		raw = np.empty(rawShape(self.detector), dtype=np.float32) if DetectorEffects.enable_detector_effects else None
+
+		# Frames are written straight into the (float32) output buffer, and
+		# published in blocks as they are completed.
+		stop = self.capture.projections if stop is None else stop
+		angles = self.capture.angles
+		published = start
+		tik = monotonic()
+
+		# Each angle is applied to the root node's original transform, rather
+		# than rotating forwards and back again, so rounding errors do not
+		# build up over a scan. The rotated transform is composed here, so the
+		# node is only updated once per angle.
+		root = gvxr.getLocalTransformationMatrix("root")
+		# gvxr matrices are column-major, so the flat matrix reshapes to its transpose.
+		root_t = np.asarray(root, dtype=np.float64).reshape(4, 4)
 		from tqdm import trange
-		for i in trange(1, self.capture.projections):
-			angle = self.capture.angles[i]
-			gvxr.rotateNode("root", angle, 0, 0)
-			images[i] = np.asarray(gvxr.computeXRayImage())
-			gvxr.rotateNode("root", -angle, 0, 0)
-
-		return images / white
+		try:
+			for i in trange(start, stop):
+				if cancelled is not None and cancelled():
+					break
+				# (root x R)^T = R^T x root^T
+				rotated = rotation_matrix(angles[i], scan_axis).T @ root_t
+				gvxr.setLocalTransformationMatrix("root", rotated.reshape(np.shape(root)).tolist())
+				if attenuation is not None and raw is not None:
+					transmission(self._pathLengths(i), *attenuation, out=raw)
+					detect(raw, self.detector, out=out[i])
+				elif attenuation is not None:
+					transmission(self._pathLengths(i), *attenuation, out=out[i])
+				else:
+					if raw is not None:
+						raw[:] = gvxr.computeXRayImage()
+						detect(raw, self.detector, out=out[i])
+					else:
+						out[i] = gvxr.computeXRayImage()
+					np.divide(out[i], white, out=out[i])
+
+				if progress is not None and (monotonic() - tik > progress_interval or i == stop - 1):
+					progress(published, i + 1)
+					published = i + 1
+					tik = monotonic()
+		finally:
+			gvxr.setLocalTransformationMatrix("root", root)
+
+		return out
+
+	def _usePathLength(self) -> bool:
+		"""Whether projections can be computed from cached path lengths."""
+		if not PathLength.enable_path_length or len(self.samples.samples) == 0:
+			return False
+
+		# A finite focal spot blurs projections, which a single ray per pixel
+		# cannot model.
+		if self.beam.params.spotSize != 0:
+			return False
+
+		self._paths.validate(self._geometryKey())
+		return self._paths.fits(self.capture.projections, (len(self.samples.samples), *self._lbufferShape()))
+
+	def _lbufferShape(self) -> Tuple[int, int]:
+		"""Shape of images raytraced by gvxr."""
+		if DetectorEffects.enable_detector_effects:
+			return rawShape(self.detector)
+		return self.detector.binned_shape
+
+	def _geometryKey(self) -> tuple:
+		"""Everything path lengths depend on. Materials, the spectrum, and
+		detector effects are not included."""
+		pixel_size = self.detector.pixel_size if DetectorEffects.enable_detector_effects else self.detector.binned_pixel_size
+		return (
+			self.beam.params.projection,
+			tuple(self._lbufferShape()),
+			pixel_size,
+			self.capture,
+			self.samples.scaling,
+			tuple((sample.label, sample.modelPath, sample.sizeUnit) for sample in self.samples.samples),
+		)
+
+	def _attenuation(self) -> Tuple[np.ndarray, np.ndarray]:
+		"""Linear attenuation coefficients of each sample per energy bin, and
+		the weight of each bin."""
+		energies = np.asarray(self.beam.spectra.energies, dtype=np.float64)
+		photons = np.asarray(self.beam.spectra.photons, dtype=np.float64)
+
+		# The detector integrates the energy it records, and empty bins are skipped.
+		weights = photons * energyResponse(energies, self.detector.scintillator)
+		used = weights > 0
+		mu = np.array([
+			[gvxr.getLinearAttenuationCoefficient(sample.label, float(energy), "keV") for sample in self.samples.samples]
+			for energy in energies[used]
+		])
+		return mu, weights[used]
+
+	def _pathLengths(self, index: int) -> np.ndarray:
+		"""Path lengths through each sample for projection `index`, which must
+		be the current orientation if they are not yet cached [cm]."""
+		paths = self._paths.get(index)
+		if paths is None:
+			paths = np.stack([np.asarray(gvxr.computeLBuffer(sample.label), dtype=np.float32) for sample in self.samples.samples])
+			paths *= lbuffer_to_cm
+			self._paths.put(index, paths)
+		return paths
 
 	@property
 	def beam(self) -> Beam:
@@ -101,13 +283,14 @@ class GVXRSimulator(Simulator):
 
 	@beam.setter
 	def beam(self, value: Beam) -> None:
-		if value.params.projection == PROJECTION.POINT:
-			gvxr.usePointSource()
-			# Focal spot is setup in capture, as it changes beam position.
-		elif value.params.projection == PROJECTION.PARALLEL:
-			gvxr.useParallelBeam()
-		else:
+		self._applySpectrum(value)
+		self._beam = value
+		self._applySource()
+
+	def _applySpectrum(self, value: Beam) -> None:
+		if value.params.projection not in (PROJECTION.POINT, PROJECTION.PARALLEL):
 			raise NotImplementedError("Only parallel or point sources are supported.")
+		self._clearWhite()
 
 		# setup spectra
 		gvxr.resetBeamSpectrum()
@@ -116,34 +299,26 @@ class GVXRSimulator(Simulator):
 				value.spectra.energies[i], "keV", value.spectra.photons[i]
 			)
 
-		# setup noise
-		if value.params.enableNoise and self.capture is not None:
-			if isinstance(value.params, LabBeam) or isinstance(value.params, MedBeam):
-				gvxr.enablePoissonNoise()
-				mAs = 1
-				if isinstance(value.params, LabBeam):
-					lab = cast(LabBeam, value.params)
-					mAs = (lab.intensity / 1000) * lab.exposure
-				else:
-					med = cast(MedBeam, value.params)
-					mAs = med.mas
-
-				electron_charge = 1.602e-19  # [C]
-				photon_count = mAs * (1.0e-3 / electron_charge) * (1 / ((self.capture.SDD * 10) ** 2))
-				gvxr.setNumberOfPhotonsPerCM2(photon_count)
-			elif isinstance(value.params, SynchBeam):
-				gvxr.enablePoissonNoise()
-				synch = cast(SynchBeam, value.params)
-
-				# flux is x10^10
-				flux = synch.flux * synch.exposure
-				gvxr.setNumberOfPhotonsPerCM2(flux * 10e10)
-			else:
-				gvxr.disablePoissonNoise()
-		else:
-			gvxr.disablePoissonNoise()
+	def _applySource(self) -> None:
+		"""Setup source type and focal spot, which depend on both the beam and
+		capture parameters."""
+		self._clearWhite()
+		if self._beam is None:
+			return
+		value = self._beam
 
-		self._beam = value
+		if value.params.projection == PROJECTION.POINT:
+			gvxr.usePointSource()
+		elif value.params.projection == PROJECTION.PARALLEL:
+			gvxr.useParallelBeam()
+
+		if self.capture is not None and value.params.spotSize != 0:
+			# todo: change to square source
+			gvxr.setFocalSpot(*self.capture.beam_position, value.params.spotSize, "mm", 3)
+
+		# Projections are always noise-free, noise is applied afterwards by the
+		# session (see webct.components.sim.Noise).
+		gvxr.disablePoissonNoise()
 
 	@property
 	def detector(self) -> DetectorParameters:
@@ -151,7 +326,24 @@ class GVXRSimulator(Simulator):
 
 	@detector.setter
 	def detector(self, value: DetectorParameters) -> None:
-
+		self._white = self._swapWhite(value)
+
+		if DetectorEffects.enable_detector_effects:
+			# gvxr only needs the native pixel grid and the scintillator, the LSF
+			# and binning are applied to its images afterwards.
+			previous = self._detector
+			if previous is None or (rawShape(previous), previous.pixel_size) != (rawShape(value), value.pixel_size):
+				self._raw_white = None
+				gvxr.clearLSF()
+				gvxr.setDetectorNumberOfPixels(rawShape(value)[1], rawShape(value)[0])
+				gvxr.setDetectorPixelSize(value.pixel_size, value.pixel_size, "mm")
+			if previous is None or previous.scintillator != value.scintillator:
+				self._raw_white = None
+				self._applyScintillator(value)
+			self._detector = value
+			return
+
+		self._raw_white = None
 		if value.enableLSF and value.lsf is not None:
 			gvxr.setLSF(value.binned_lsf)
 		else:
@@ -161,7 +353,10 @@ class GVXRSimulator(Simulator):
 		gvxr.setDetectorNumberOfPixels(value.binned_shape[1], value.binned_shape[0])
 		gvxr.setDetectorPixelSize(value.binned_pixel_size, value.binned_pixel_size, "mm")
 
+		self._applyScintillator(value)
+		self._detector = value
 
+	def _applyScintillator(self, value: DetectorParameters) -> None:
 		if value.scintillator.material == SCINTILLATOR_MATERIAL.NONE:
 			gvxr.clearDetectorEnergyResponse()
 		elif value.scintillator.material == SCINTILLATOR_MATERIAL.CUSTOM:
@@ -169,66 +364,106 @@ class GVXRSimulator(Simulator):
 		else:
 			gvxr.setScintillator(value.scintillator.material.value, value.scintillator.thickness, "mm")
 
-		self._detector = value
-
 	@property
 	def samples(self) -> RenderedSampleSettings:
 		return self._samples
 
 	@samples.setter
 	def samples(self, value: RenderedSampleSettings) -> None:
-		gvxr.removePolygonMeshesFromSceneGraph()
-
-		if self.samples is not None:
+		# Samples are diffed by label, so only changed meshes, materials, or
+		# scaling are touched.
+		previous = {} if self.samples is None else {sample.label: sample for sample in self.samples.samples}
+		current = {sample.label: sample for sample in value.samples}
+
+		# gvxr cannot remove a single mesh, so removing a sample or changing its
+		# model requires all meshes to be reloaded.
+		reload = self.samples is None or any(
+			label not in current
+			or (current[label].modelPath, current[label].sizeUnit) != (sample.modelPath, sample.sizeUnit)
+			for label, sample in previous.items()
+		)
+		load = value.samples if reload else [sample for sample in value.samples if sample.label not in previous]
+		rescale = self.samples is None or len(load) > 0 or value.scaling != self.samples.scaling
+
+		if rescale and self.samples is not None:
 			# revert scaling on scene node
 			corrective_scale = 1 / self.samples.scaling
 			gvxr.scaleScene(corrective_scale, corrective_scale, corrective_scale, "mm")
 
-		for sample in value.samples:
-			label = sample.label
-			mat: Material = sample.material
-
-			gvxr.loadMeshFile(label, f"{model_folder}{sample.modelPath}", sample.sizeUnit)
-
-			if isinstance(mat, ElementMaterial):
-				gvxr.setElement(label, mat.element)
-			elif isinstance(mat, CompoundMaterial):
-				gvxr.setCompound(label, mat.compound)
-			elif isinstance(mat, MixtureMaterial):
-				gvxr.setMixture(label, mat.atomicNumbers, mat.weights)
-			elif isinstance(mat, HUMaterial):
-				gvxr.setHU(label, mat.HUunit)
-			else:
-				raise NotImplementedError(f"Invalid MaterialType '{type(mat)}' {mat}")
-
-			# Density has to be set after setting the mixture, otherwise gvxr crashes.
-			if not isinstance(mat, HUMaterial):
-				gvxr.setDensity(label, mat.density, "g/cm3")
+		if reload:
+			gvxr.removePolygonMeshesFromSceneGraph()
+		else:
+			# Existing meshes only need materials updating.
+			for sample in value.samples:
+				if sample.label in previous and sample.material != previous[sample.label].material:
+					self._applyMaterial(sample)
 
-			gvxr.setColour(label, *colour_from_string(label), 1)
-			gvxr.moveToCenter(label)
+		for sample in load:
+			self._loadMesh(sample)
+			self._applyMaterial(sample)
+			gvxr.setColour(sample.label, *colour_from_string(sample.label), 1)
+			gvxr.moveToCenter(sample.label)
 
 		# Apply global sample properties
-		gvxr.scaleScene(value.scaling, value.scaling, value.scaling, "mm")
+		if rescale:
+			gvxr.scaleScene(value.scaling, value.scaling, value.scaling, "mm")
 		self._samples = value
 
+	def _loadMesh(self, sample: RenderedSample) -> None:
+		path = f"{model_folder}{sample.modelPath}"
+		if not path.lower().endswith(".stl"):
+			# Only STL geometry is cached, let gvxr handle anything else.
+			gvxr.loadMeshFile(sample.label, path, sample.sizeUnit)
+			return
+
+		tik = monotonic()
+		try:
+			mesh = self._meshes.get(path)
+		except ValueError:
+			# gvxr's own loader copes with some files the parser does not.
+			log.warning(f"Unable to parse {path}, loading it with gvxr instead")
+			gvxr.loadMeshFile(sample.label, path, sample.sizeUnit)
+			return
+		tok = monotonic()
+		gvxr.makeTriangularMesh(sample.label, mesh.coordinates, sample.sizeUnit)
+		log.info(f"Loaded {len(mesh.vertices) // 3} triangles for {sample.label} in {monotonic() - tik:.3f}s ({tok - tik:.3f}s in the mesh cache)")
+
+	def _applyMaterial(self, sample: RenderedSample) -> None:
+		label = sample.label
+		mat: Material = sample.material
+
+		if isinstance(mat, ElementMaterial):
+			gvxr.setElement(label, mat.element)
+		elif isinstance(mat, CompoundMaterial):
+			gvxr.setCompound(label, mat.compound)
+		elif isinstance(mat, MixtureMaterial):
+			gvxr.setMixture(label, mat.atomicNumbers, mat.weights)
+		elif isinstance(mat, HUMaterial):
+			gvxr.setHU(label, mat.HUunit)
+		else:
+			raise NotImplementedError(f"Invalid MaterialType '{type(mat)}' {mat}")
+
+		# Density has to be set after setting the mixture, otherwise gvxr crashes.
+		if not isinstance(mat, HUMaterial):
+			gvxr.setDensity(label, mat.density, "g/cm3")
+
 	@property
 	def capture(self) -> CaptureParameters:
 		return self._capture
 
 	@capture.setter
 	def capture(self, value: CaptureParameters) -> None:
-		print(value)
-		gvxr.setDetectorPosition(*value.detector_position, "mm")
-		gvxr.setSourcePosition(*value.beam_position, "mm")
-
-		if self.beam.params.spotSize != 0:
-			# todo: change to square source
-			gvxr.setFocalSpot(*self.capture.beam_position, self.beam.params.spotSize, "mm", 3)
+		self._applyGeometry(value)
+		self._capture = value
 
 		# Changing detector/source position will effect if the source is in
-		# parallel or point mode. We re-set the beam value to fix this.
-		self.beam = self._beam
+		# parallel or point mode, along with the focal spot and noise.
+		self._applySource()
+
+	def _applyGeometry(self, value: CaptureParameters) -> None:
+		self._clearWhite()
+		gvxr.setDetectorPosition(*value.detector_position, "mm")
+		gvxr.setSourcePosition(*value.beam_position, "mm")
 
 		# Undo rotations in order to reset scene rotation matrix
 		if self.laminography:
@@ -251,10 +486,26 @@ class GVXRSimulator(Simulator):
 			gvxr.rotateNode("root", value.sample_rotation[0], 1, 0, 0)
 			gvxr.rotateNode("root", value.sample_rotation[1], 0, 1, 0)
 			gvxr.rotateNode("root", value.sample_rotation[2], 0, 0, 1)
-		self._capture = value
-
 
-	def RenderScene(self) -> Tuple[Tuple[float]]:
+	def configure(self, beam: Optional[Beam] = None, detector: Optional[DetectorParameters] = None,
+			samples: Optional[RenderedSampleSettings] = None, capture: Optional[CaptureParameters] = None) -> None:
+		if samples is not None:
+			self.samples = samples
+		if detector is not None:
+			self.detector = detector
+		if capture is not None:
+			self._applyGeometry(capture)
+			self._capture = capture
+		if beam is not None:
+			self._applySpectrum(beam)
+			self._beam = beam
+
+		# Source properties depend on both beam and capture, so are only applied once.
+		if beam is not None or capture is not None:
+			self._applySource()
+
+	def RenderScene(self) -> np.ndarray:
+		"""Render the scene, returning an 8-bit RGB image."""
 		gvxr.displayScene()
 		# gvxr.renderLoop()
 
@@ -272,4 +523,8 @@ class GVXRSimulator(Simulator):
 		gvxr.takeScreenshot()
 		gvxr.displayScene()
 
-		return gvxr.takeScreenshot()
+		# Screenshots are nested tuples, convert once and scale as a whole.
+		image = np.asarray(gvxr.takeScreenshot(), dtype=np.float32)
+		if image.max() <= 1:
+			image *= 255
+		return np.clip(image, 0, 255, out=image).astype(np.uint8)
@@ -0,0 +1,100 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import os
+import re
+import sys
+import logging
+log = logging.getLogger("Simulator")
+
+import numpy as np
+
+# Largest total size of mesh geometry kept by a simulator process [bytes]
+mesh_cache_size = 512 * 1024 * 1024
+
+_ascii_vertex = re.compile(rb"vertex\s+(\S+)\s+(\S+)\s+(\S+)")
+
+
+@dataclass(frozen=True)
+class Mesh:
+	"""Triangle soup parsed from a model file."""
+	vertices: np.ndarray  # (triangles * 3, 3) float32 array of vertex positions
+	coordinates: List[float]  # Flattened vertices, as passed to gvxr.makeTriangularMesh
+	digest: str  # sha1 of the file contents
+
+	@property
+	def nbytes(self) -> int:
+		# Each coordinate in the list is a separate float object.
+		return self.vertices.nbytes + sys.getsizeof(self.coordinates) + len(self.coordinates) * sys.getsizeof(0.0)
+
+
+def parseSTL(data: bytes) -> np.ndarray:
+	"""Parse a binary or ASCII STL file into a (triangles * 3, 3) vertex array."""
+	if len(data) >= 84:
+		count = int(np.frombuffer(data, dtype="<u4", count=1, offset=80)[0])
+		if len(data) == 84 + count * 50:
+			# Each record is a normal, three vertices, and an attribute count.
+			record = np.dtype([("normal", "<f4", (3,)), ("vertices", "<f4", (3, 3)), ("attribute", "<u2")])
+			triangles = np.frombuffer(data, dtype=record, count=count, offset=84)
+			return triangles["vertices"].reshape(-1, 3).astype(np.float32)
+
+	vertices = np.array(_ascii_vertex.findall(data), dtype=np.float32)
+	if vertices.size == 0 or len(vertices) % 3 != 0:
+		raise ValueError("Unable to parse STL file.")
+	return vertices
+
+
+class MeshCache:
+	"""LRU cache of parsed mesh geometry.
+
+	Files are looked up by path, modification time, and size, so unchanged
+	files are not re-read. Geometry itself is keyed by a hash of the file's
+	contents, so a re-uploaded copy of a model shares the cached entry.
+	"""
+
+	def __init__(self, capacity: Optional[int] = None) -> None:
+		self.capacity = mesh_cache_size if capacity is None else capacity
+		self.hits = 0
+		self.misses = 0
+		self._files: Dict[Tuple[str, int, int], str] = {}
+		self._meshes: "OrderedDict[str, Mesh]" = OrderedDict()
+		self._size = 0
+
+	def get(self, path: str) -> Mesh:
+		stat = os.stat(path)
+		key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+		digest = self._files.get(key)
+		if digest is None or digest not in self._meshes:
+			with open(path, "rb") as f:
+				data = f.read()
+			digest = hashlib.sha1(data).hexdigest()
+			self._files[key] = digest
+
+			if digest not in self._meshes:
+				self.misses += 1
+				vertices = parseSTL(data)
+				# Converting to a list costs several times the parse, so is cached too.
+				mesh = Mesh(vertices, vertices.ravel().tolist(), digest)
+				self._meshes[digest] = mesh
+				self._size += mesh.nbytes
+				self._evict()
+				log.info(f"Mesh cache miss for {path} ({self.hits} hits, {self.misses} misses, {self._size / 1024 / 1024:.1f} MiB)")
+				return mesh
+
+		self.hits += 1
+		self._meshes.move_to_end(digest)
+		log.info(f"Mesh cache hit for {path} ({self.hits} hits, {self.misses} misses, {self._size / 1024 / 1024:.1f} MiB)")
+		return self._meshes[digest]
+
+	def _evict(self) -> None:
+		# The most recent mesh is always kept, even if it exceeds the capacity.
+		while self._size > self.capacity and len(self._meshes) > 1:
+			digest, mesh = self._meshes.popitem(last=False)
+			self._size -= mesh.nbytes
+			log.info(f"Evicted mesh {digest[:8]} from cache ({mesh.nbytes / 1024 / 1024:.1f} MiB)")
+
+		# Forget files whose geometry is no longer cached.
+		for key in [key for key, digest in self._files.items() if digest not in self._meshes]:
+			del self._files[key]
@@ -0,0 +1,99 @@
+"""Projections from cached path lengths, using polychromatic Beer-Lambert.
+
+Attenuation is separable: the length of a ray through each sample depends
+only on the geometry, while the beam spectrum and the materials only weight
+those lengths. Path lengths are raytraced once for each angle, and
+projections for new spectra, materials, or densities are then computed with
+numpy rather than raytraced again.
+"""
+
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Tuple
+import logging
+log = logging.getLogger("Simulator")
+
+import numpy as np
+
+# Simulate projections from cached path lengths instead of raytracing each one.
+# A focal spot cannot be modelled from path lengths, and the LSF is only
+# applied with `DetectorEffects.enable_detector_effects`, so this is opt-in.
+enable_path_length = False
+
+# Largest total size of cached path length maps per simulator [bytes]
+path_cache_size = 1024 * 1024 * 1024
+
+# gvxr returns L-buffers in its internal unit of length (mm), while
+# attenuation coefficients are given per cm.
+lbuffer_to_cm = 0.1
+
+
+def transmission(paths: np.ndarray, mu: np.ndarray, weights: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+	"""Combine path lengths with a spectrum to give a transmission image.
+
+	Args:
+		paths (np.ndarray): (samples, height, width) path length through each sample [cm].
+		mu (np.ndarray): (energies, samples) linear attenuation coefficients [cm^-1].
+		weights (np.ndarray): (energies,) detected signal per energy bin without
+			attenuation, the number of photons multiplied by the detector response.
+		out (np.ndarray, optional): (height, width) array to write into.
+
+	Returns:
+		np.ndarray: Transmission image, the detected signal relative to a flat field.
+	"""
+	shape = paths.shape[1:]
+	# Optical depth for every energy and pixel, as a single matrix product.
+	depth = mu.astype(np.float32) @ paths.reshape(paths.shape[0], -1)
+	np.negative(depth, out=depth)
+	np.exp(depth, out=depth)
+
+	image = (weights.astype(np.float32) / np.float32(weights.sum())) @ depth
+	if out is None:
+		return image.reshape(shape)
+	np.copyto(out, image.reshape(shape))
+	return out
+
+
+class PathLengthCache:
+	"""Path length maps for each angle of a scan, grouped by geometry.
+
+	Maps are only valid for the geometry they were raytraced with, given by
+	the key passed to `validate`. Maps of other geometries are kept, so
+	switching back (such as after a coarse preview) does not raytrace them
+	again, and are dropped least recently used first once the cache is full.
+	"""
+
+	def __init__(self, capacity: Optional[int] = None) -> None:
+		self.capacity = path_cache_size if capacity is None else capacity
+		self._key: Hashable = None
+		# Maps of each geometry by angle, least recently used first
+		self._geometries: "OrderedDict[Hashable, Dict[int, np.ndarray]]" = OrderedDict()
+		self._size = 0
+
+	def validate(self, key: Hashable) -> None:
+		"""Switch to the maps of a geometry."""
+		if key != self._key and not self._geometries.get(self._key, True):
+			# Nothing was cached for the previous geometry.
+			del self._geometries[self._key]
+		self._key = key
+		self._geometries.setdefault(key, {})
+		self._geometries.move_to_end(key)
+
+	def get(self, index: int) -> Optional[np.ndarray]:
+		return self._geometries.get(self._key, {}).get(index)
+
+	def put(self, index: int, paths: np.ndarray) -> bool:
+		"""Cache path lengths for an angle of the current geometry, dropping
+		maps of other geometries if needed. Returns False if the cache is full."""
+		while self._size + paths.nbytes > self.capacity and len(self._geometries) > 1:
+			key, maps = self._geometries.popitem(last=False)
+			self._size -= sum(m.nbytes for m in maps.values())
+			log.info(f"Path length cache full, dropping {len(maps)} maps of a previous geometry")
+		if self._size + paths.nbytes > self.capacity:
+			return False
+		self._geometries.setdefault(self._key, {})[index] = paths
+		self._size += paths.nbytes
+		return True
+
+	def fits(self, count: int, shape: Tuple[int, ...]) -> bool:
+		"""Whether maps for `count` angles of the given shape fit in the cache."""
+		return count * int(np.prod(shape)) * 4 <= self.capacity
@@ -1,5 +1,5 @@
 from abc import ABCMeta, abstractmethod
-from typing import List
+from typing import Callable, List, Optional
 import numpy as np
 
 from webct.components.Beam import Beam
@@ -7,6 +7,9 @@ from webct.components.Capture import CaptureParameters
 from webct.components.Detector import DetectorParameters
 from webct.components.Samples import RenderedSampleSettings
 
+# Minimum time between progress reports while simulating all projections [s]
+progress_interval = 0.25
+
 
 class Simulator(metaclass=ABCMeta):
 	"""Simulator metaclass for all backend simulation packages.
@@ -28,6 +31,10 @@ class Simulator(metaclass=ABCMeta):
 		self._simSettings: dict[str, str] = {}
 		self._capture: CaptureParameters = None
 
+	def setSession(self, sid: str) -> None:
+		"""Called when a standby process is claimed by a session."""
+		self._sid = sid
+
 	@abstractmethod
 	def SimSingleProjection(self) -> np.ndarray:
 		"""Generate a single image of the scene. Commonly used for previewing
@@ -35,10 +42,50 @@ class Simulator(metaclass=ABCMeta):
 		raise NotImplementedError()
 
 	@abstractmethod
-	def SimAllProjections(self) -> np.ndarray:
-		"""Generate all projections of a scene."""
+	def SimFlatField(self) -> np.ndarray:
+		"""Generate an image of the beam with no samples in the way. Depends on
+		the beam, detector, and capture parameters, but not the samples."""
 		raise NotImplementedError()
 
+	@abstractmethod
+	def SimAllProjections(self, out: np.ndarray, progress: Optional[Callable[[int, int], None]] = None, start: int = 0, stop: Optional[int] = None,
+			cancelled: Optional[Callable[[], bool]] = None) -> np.ndarray:
+		"""Generate all projections of a scene, or a range of them.
+
+		Args:
+			out (np.ndarray): Preallocated float32 array of shape
+				(projections, height, width) to write projections into.
+			progress (Callable[[int, int], None], optional): Called with the
+				(start, stop) range of projections once they are written to `out`.
+				An empty range reports progress on setup, such as a flat field.
+			start (int, optional): Index of the first projection to simulate. Defaults to 0.
+			stop (int, optional): Index after the last projection to simulate.
+				Defaults to all projections.
+			cancelled (Callable[[], bool], optional): Checked between angles,
+				simulation stops early once it returns True.
+
+		Returns:
+			np.ndarray: `out`, filled with flat-field corrected projections.
+				Projections after a cancellation are left unwritten.
+		"""
+		raise NotImplementedError()
+
+	def configure(self, beam: Optional[Beam] = None, detector: Optional[DetectorParameters] = None,
+			samples: Optional[RenderedSampleSettings] = None, capture: Optional[CaptureParameters] = None) -> None:
+		"""Apply any subset of parameters at once, in dependency order.
+
+		Implementations may override this to avoid repeating work shared
+		between parameters.
+		"""
+		if samples is not None:
+			self.samples = samples
+		if detector is not None:
+			self.detector = detector
+		if beam is not None:
+			self.beam = beam
+		if capture is not None:
+			self.capture = capture
+
 	@property
 	def beam(self) -> Beam:
 		return self._beam